@@ -1,5 +1,6 @@
 import os
 import asyncpg
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,6 +12,16 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "postgres")
 
+# Pool sizing (Supabase caps client connections, so keep the pool bounded)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+
+# Supabase pooler mode: "transaction" (port 6543) cannot keep prepared
+# statements between queries; "session" (port 5432 / direct) can
+DB_POOLER_MODE = os.getenv("DB_POOLER_MODE", "transaction").lower()
+DB_STATEMENT_CACHE_SIZE = 1024 if DB_POOLER_MODE == "session" else 0
+
 POOL = None
 
 async def init_pool():
@@ -19,7 +30,8 @@ async def init_pool():
         print("WARNING: DB_USER, DB_PASSWORD, or DB_HOST is not set. Database features will be unavailable.")
         return
     try:
-        # statement_cache_size=0 is required for Supabase connection pooler
+        # statement_cache_size=0 is required for Supabase's transaction pooler;
+        # session mode re-enables asyncpg's prepared statement cache
         POOL = await asyncpg.create_pool(
             user=DB_USER,
             password=DB_PASSWORD,
@@ -27,7 +39,12 @@ async def init_pool():
             port=int(DB_PORT),
             database=DB_NAME,
             ssl='require',
-            statement_cache_size=0,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            max_queries=50000,
+            max_inactive_connection_lifetime=1800,
+            command_timeout=DB_COMMAND_TIMEOUT,
         )
         print("✓ Database pool initialized successfully.")
     except OSError as e:
@@ -44,10 +61,49 @@ async def close_pool():
     if POOL:
         await POOL.close()
 
+@asynccontextmanager
 async def get_db_connection():
     if not POOL:
         raise RuntimeError("Database pool is not available. Check your DATABASE_URL configuration.")
-    return POOL.acquire()
+    async with POOL.acquire() as conn:
+        yield conn
+
+SCHEMA_DDL = '''
+-- Enable UUID extension
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+
+-- User Table
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    email VARCHAR(255) UNIQUE,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Conversations Table
+CREATE TABLE IF NOT EXISTS conversations (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id TEXT NOT NULL,
+    title VARCHAR(500),
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Messages Table
+CREATE TABLE IF NOT EXISTS messages (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    metadata JSONB,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Indexes
+CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(conversation_id, created_at ASC);
+'''
 
 async def init_db():
     if not POOL:
@@ -55,46 +111,9 @@ async def init_db():
         return
     try:
         async with POOL.acquire() as conn:
-            # Enable UUID extension
-            await conn.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
-            
-            # User Table
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                    email VARCHAR(255) UNIQUE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            ''')
-
-            # Conversations Table
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                    user_id TEXT NOT NULL,
-                    title VARCHAR(500),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                );
-            ''')
-            
-            # Messages Table
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                    conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
-                    role VARCHAR(20) NOT NULL,
-                    content TEXT NOT NULL,
-                    metadata JSONB,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            ''')
-            
-            # Indexes
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id);')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(user_id, updated_at DESC);')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(conversation_id, created_at ASC);')
+            # One round-trip: without bind params asyncpg sends the whole
+            # script via the simple query protocol (runs as one implicit transaction)
+            await conn.execute(SCHEMA_DDL)
             
             print("✓ Database tables initialized successfully.")
     except Exception as e:
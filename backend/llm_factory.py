@@ -1,15 +1,32 @@
 import os
+import re
+import logging
+import asyncio
 import json
 import time
+import threading
+import functools
+import hashlib
+import sqlite3
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaGrammar, LlamaRAMCache
 except ImportError:
     Llama = None
+    LlamaGrammar = None
+    LlamaRAMCache = None
+
+try:
+    from json_repair import repair_json
+except ImportError:
+    repair_json = None
 
 from tenacity import (
     retry,
@@ -19,17 +36,22 @@ from tenacity import (
 )
 import groq
 
+log = logging.getLogger(__name__)
+
 # -------------------------------
 # Base Provider Interface
 # -------------------------------
 
 class LLMProvider(ABC):
+    # Requests generate_text_batch keeps in flight unless told otherwise
+    max_concurrency: int = 8
+
     @abstractmethod
     def generate_text(self, prompt: str, **kwargs) -> str:
         pass
 
     @abstractmethod
-    def generate_json(self, prompt: str) -> Dict[str, Any]:
+    def generate_json(self, prompt: str, **kwargs) -> Dict[str, Any]:
         pass
 
     @property
@@ -37,6 +59,26 @@ class LLMProvider(ABC):
     def provider_name(self) -> str:
         pass
 
+    async def agenerate_text(self, prompt: str, **kwargs) -> str:
+        """Async generate_text; providers without an async SDK run it in a worker thread."""
+        return await asyncio.to_thread(self.generate_text, prompt, **kwargs)
+
+    async def astream_text(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Yields the response in chunks as it is generated. Providers without
+        streaming support yield the whole agenerate_text result at once."""
+        yield await self.agenerate_text(prompt, **kwargs)
+
+    async def generate_text_batch(self, prompts: List[str], concurrency: Optional[int] = None, **kwargs) -> List[str]:
+        """Runs agenerate_text over many prompts with at most `concurrency`
+        (default max_concurrency) requests in flight, preserving prompt order."""
+        semaphore = asyncio.Semaphore(concurrency or self.max_concurrency)
+
+        async def _one(prompt: str) -> str:
+            async with semaphore:
+                return await self.agenerate_text(prompt, **kwargs)
+
+        return await asyncio.gather(*(_one(p) for p in prompts))
+
 
 # -------------------------------
 # Retry Filter (DO NOT retry 429)
@@ -46,23 +88,295 @@ def is_retryable_error(e: Exception) -> bool:
     return "429" not in str(e)
 
 
+# -------------------------------
+# JSON Response Parsing
+# -------------------------------
+
+# Leading ```json / trailing ``` markdown fences around model output
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+def _first_json_object(text: str):
+    """Single pass over text returning the first balanced {...} span (string-aware), or None."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    text = _FENCE_RE.sub("", text.strip())
+
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+
+    # Prose around the object: cut out the first balanced object
+    candidate = _first_json_object(text)
+    if candidate is not None:
+        try:
+            return orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            pass
+
+    # Malformed JSON (trailing commas, single quotes, truncation) if json-repair is installed
+    if repair_json is not None:
+        try:
+            repaired = repair_json(candidate or text, return_objects=True)
+            if isinstance(repaired, dict):
+                return repaired
+        except Exception:
+            pass
+    return {}
+
+
+# -------------------------------
+# Rate Limiting (token bucket)
+# -------------------------------
+
+class TokenBucketLimiter:
+    """Thread-safe token bucket: callers only wait when the bucket is empty."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self._rate = rate_per_minute / 60.0
+        self._capacity = float(max(1, burst))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token and returns how long the caller must wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# Free-tier Gemini quota; override with GEMINI_RPM / GEMINI_BURST
+GEMINI_LIMITER = TokenBucketLimiter(
+    rate_per_minute=float(os.getenv("GEMINI_RPM", "60")),
+    burst=int(os.getenv("GEMINI_BURST", "5"))
+)
+
+
+# -------------------------------
+# Shared SDK Clients
+# -------------------------------
+
+# One client per API key per process, so every provider instance reuses
+# the same keep-alive HTTP connection pool instead of re-handshaking TLS.
+
+@functools.lru_cache(maxsize=None)
+def get_gemini_client(api_key: str) -> genai.Client:
+    return genai.Client(api_key=api_key)
+
+@functools.lru_cache(maxsize=None)
+def get_groq_client(api_key: str) -> groq.Groq:
+    return groq.Groq(api_key=api_key)
+
+
+# -------------------------------
+# Response Cache (prompt-hash keyed)
+# -------------------------------
+
+class ResponseCache:
+    """Thread-safe in-process LRU with per-entry TTL for LLM outputs.
+
+    Values are stored orjson-serialized so every hit hands back a fresh
+    object (callers mutate the returned dicts when building step logs).
+    With a path, entries are also written to a SQLite file so they survive
+    restarts; in-memory misses fall back to it.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400, path: str = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, expires_at REAL, payload BLOB)"
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(namespace: str, prompt: str) -> str:
+        digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+        return f"llm:{namespace}:{digest}"
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at < time.monotonic():
+                    del self._data[key]
+                    return None
+                self._data.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT payload, expires_at FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                    (key, time.time())
+                ).fetchone()
+                if row is None:
+                    return None
+                payload = row[0]
+                self._remember(key, payload, row[1] - time.time())
+            else:
+                return None
+        return orjson.loads(payload)
+
+    def set(self, key: str, value):
+        payload = orjson.dumps(value)
+        with self._lock:
+            self._remember(key, payload, self._ttl)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)",
+                    (key, time.time() + self._ttl, payload)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, payload: bytes, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, payload)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+
+LLM_RESPONSE_CACHE = ResponseCache(
+    maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    path=os.getenv("LLM_CACHE_PATH")
+)
+
+def llm_cache(method):
+    """Caches a provider's generate_* output by (provider_name, method, prompt hash).
+
+    Empty results are not cached: providers return {} on errors/quota hits.
+    """
+    @functools.wraps(method)
+    def wrapper(self, prompt: str, *args, **kwargs):
+        key = ResponseCache.make_key(f"{self.provider_name}:{method.__name__}", prompt)
+        cached = LLM_RESPONSE_CACHE.get(key)
+        if cached is not None:
+            return cached
+        result = method(self, prompt, *args, **kwargs)
+        if result:
+            LLM_RESPONSE_CACHE.set(key, result)
+        return result
+    return wrapper
+
+
 # -------------------------------
 # Gemini Provider
 # -------------------------------
 
 class GeminiProvider(LLMProvider):
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
+    def __init__(self, model_name: str = "gemini-2.5-flash", max_concurrency: int = 8):
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found in environment variables.")
 
-        self.client = genai.Client(api_key=api_key)
+        self.client = get_gemini_client(api_key)
         self._model_name = model_name
+        self.max_concurrency = max_concurrency
 
     @property
     def provider_name(self) -> str:
         return f"Gemini ({self._model_name})"
 
+    def _text_config(self, **kwargs) -> types.GenerateContentConfig:
+        tool_config = None
+        tools_arg = kwargs.get('tools')
+        
+        # Simple mapping: if user passed 'google_search', use the proper tool type
+        # Or if they passed the dict {'google_search': {}} from previous step
+        if tools_arg:
+            # We interpret any truthy tool arg (that isn't empty) as a request for google search 
+            # if it matches our known key, or we just enable it if requested.
+            # Pipeline passes: {'google_search': {}} or similar.
+            
+            # Check for our specific flag or dict key
+            use_search = False
+            if isinstance(tools_arg, dict) and 'google_search' in tools_arg:
+                use_search = True
+            elif tools_arg == 'google_search':
+                use_search = True
+            
+            if use_search:
+                 tool_config = [types.Tool(google_search=types.GoogleSearch())]
+
+        return types.GenerateContentConfig(tools=tool_config)
+
+    def _text_result(self, response, **kwargs):
+        if kwargs.get('return_full_response'):
+            metadata = None
+            if response.candidates and response.candidates[0].grounding_metadata:
+                gm = response.candidates[0].grounding_metadata
+                chunks = []
+                if gm.grounding_chunks:
+                    for chunk in gm.grounding_chunks:
+                        if chunk.web:
+                            chunks.append({
+                                "title": chunk.web.title,
+                                "url": chunk.web.uri
+                            })
+                metadata = {"chunks": chunks}
+            
+            return {
+                "text": response.text,
+                "grounding_metadata": metadata
+            }
+            
+        return response.text
+
+    def _text_error(self, e: Exception) -> str:
+        error_msg = str(e)
+        if "429" in error_msg:
+            log.critical("Gemini quota exceeded (429): %s", error_msg)
+            return "System limited: Gemini API quota exceeded. Please wait a moment."
+        else:
+            log.error("Gemini Text Generation Error: %s", error_msg)
+            return f"Thinking process interrupted: {error_msg}"
+
     @retry(
         wait=wait_exponential(multiplier=1, min=2, max=10),
         stop=stop_after_attempt(3),
@@ -70,71 +384,56 @@ class GeminiProvider(LLMProvider):
     )
     def generate_text(self, prompt: str, **kwargs) -> str:
         try:
-            time.sleep(0.3)  # throttle free-tier usage
-            
-            tool_config = None
-            tools_arg = kwargs.get('tools')
-            
-            # Simple mapping: if user passed 'google_search', use the proper tool type
-            # Or if they passed the dict {'google_search': {}} from previous step
-            if tools_arg:
-                # We interpret any truthy tool arg (that isn't empty) as a request for google search 
-                # if it matches our known key, or we just enable it if requested.
-                # Pipeline passes: {'google_search': {}} or similar.
-                
-                # Check for our specific flag or dict key
-                use_search = False
-                if isinstance(tools_arg, dict) and 'google_search' in tools_arg:
-                    use_search = True
-                elif tools_arg == 'google_search':
-                    use_search = True
-                
-                if use_search:
-                     tool_config = [types.Tool(google_search=types.GoogleSearch())]
-
+            GEMINI_LIMITER.acquire()  # throttle free-tier usage
             response = self.client.models.generate_content(
                 model=self._model_name,
                 contents=prompt,
-                config=types.GenerateContentConfig(
-                    tools=tool_config
-                )
+                config=self._text_config(**kwargs)
             )
-            
-            if kwargs.get('return_full_response'):
-                metadata = None
-                if response.candidates and response.candidates[0].grounding_metadata:
-                    gm = response.candidates[0].grounding_metadata
-                    chunks = []
-                    if gm.grounding_chunks:
-                        for chunk in gm.grounding_chunks:
-                            if chunk.web:
-                                chunks.append({
-                                    "title": chunk.web.title,
-                                    "url": chunk.web.uri
-                                })
-                    metadata = {"chunks": chunks}
-                
-                return {
-                    "text": response.text,
-                    "grounding_metadata": metadata
-                }
-                
-            return response.text
+            return self._text_result(response, **kwargs)
         except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg:
-                print(f"CRITICAL: Gemini quota exceeded (429): {error_msg}")
-                return "System limited: Gemini API quota exceeded. Please wait a moment."
-            else:
-                print(f"Gemini Text Generation Error: {error_msg}")
-                return f"Thinking process interrupted: {error_msg}"
+            return self._text_error(e)
+
+    @retry(
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        stop=stop_after_attempt(3),
+        retry=retry_if_exception(is_retryable_error)
+    )
+    async def agenerate_text(self, prompt: str, **kwargs) -> str:
+        # Native async client: no thread-pool worker is held while waiting
+        try:
+            await GEMINI_LIMITER.acquire_async()  # throttle free-tier usage
+            response = await self.client.aio.models.generate_content(
+                model=self._model_name,
+                contents=prompt,
+                config=self._text_config(**kwargs)
+            )
+            return self._text_result(response, **kwargs)
+        except Exception as e:
+            return self._text_error(e)
+
+    async def astream_text(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        # No retry here: chunks may already have been sent to the client
+        try:
+            await GEMINI_LIMITER.acquire_async()  # throttle free-tier usage
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self._model_name,
+                contents=prompt,
+                config=self._text_config(**kwargs)
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            yield self._text_error(e)
 
+    @llm_cache
     @retry(
         wait=wait_exponential(multiplier=1, min=2, max=10),
         stop=stop_after_attempt(3),
         retry=retry_if_exception(is_retryable_error)
     )
-    def generate_json(self, prompt: str) -> Dict[str, Any]:
+    def generate_json(self, prompt: str, **kwargs) -> Dict[str, Any]:
         try:
             json_prompt = (
                 "You are a JSON generator.\n"
@@ -142,7 +441,7 @@ class GeminiProvider(LLMProvider):
                 "No explanation. No markdown.\n\n"
                 + prompt
             )
-            time.sleep(0.3)  # throttle free-tier usage
+            GEMINI_LIMITER.acquire()  # throttle free-tier usage
             response = self.client.models.generate_content(
                 model=self._model_name,
                 contents=json_prompt,
@@ -150,31 +449,12 @@ class GeminiProvider(LLMProvider):
                     response_mime_type="application/json"
                 )
             )
-            return self._parse_json(response.text)
+            return parse_json_response(response.text)
         except Exception as e:
             if "429" in str(e):
-                print("Gemini quota exceeded. Skipping retry.")
+                log.warning("Gemini quota exceeded. Skipping retry.")
             else:
-                print(f"Gemini JSON Generation Error: {e}")
-            return {}
-
-    def _parse_json(self, text: str) -> Dict[str, Any]:
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            start = text.find("{")
-            end = text.rfind("}") + 1
-            if start != -1 and end != -1:
-                try:
-                    return json.loads(text[start:end])
-                except Exception:
-                    pass
+                log.error("Gemini JSON Generation Error: %s", e)
             return {}
 
 
@@ -184,13 +464,14 @@ class GeminiProvider(LLMProvider):
 # -------------------------------
 
 class GroqProvider(LLMProvider):
-    def __init__(self, model_name: str = "llama-3.3-70b-versatile"):
+    def __init__(self, model_name: str = "llama-3.3-70b-versatile", max_concurrency: int = 8):
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables.")
 
-        self.client = groq.Groq(api_key=api_key)
+        self.client = get_groq_client(api_key)
         self.model = model_name
+        self.max_concurrency = max_concurrency
 
     @property
     def provider_name(self) -> str:
@@ -215,17 +496,18 @@ class GroqProvider(LLMProvider):
             return chat_completion.choices[0].message.content
         except Exception as e:
             if "429" in str(e):
-                print("Groq quota exceeded. Skipping retry.")
+                log.warning("Groq quota exceeded. Skipping retry.")
             else:
-                print(f"Groq Text Generation Error: {e}")
+                log.error("Groq Text Generation Error: %s", e)
             return "Thinking process interrupted."
 
+    @llm_cache
     @retry(
         wait=wait_exponential(multiplier=1, min=2, max=10),
         stop=stop_after_attempt(3),
         retry=retry_if_exception(is_retryable_error)
     )
-    def generate_json(self, prompt: str) -> Dict[str, Any]:
+    def generate_json(self, prompt: str, **kwargs) -> Dict[str, Any]:
         try:
             json_prompt = (
                 "You are a JSON generator.\n"
@@ -246,83 +528,122 @@ class GroqProvider(LLMProvider):
             return json.loads(chat_completion.choices[0].message.content)
         except Exception as e:
             if "429" in str(e):
-                print("Groq quota exceeded. Skipping retry.")
+                log.warning("Groq quota exceeded. Skipping retry.")
             else:
-                print(f"Groq JSON Generation Error: {e}")
+                log.error("Groq JSON Generation Error: %s", e)
             return {}
 
 # -------------------------------
 # Local LLaMA Provider
 # -------------------------------
 
+# Llama 3 chat scaffolding around a single user turn
+LLAMA3_USER_PREFIX = "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+LLAMA3_ASSISTANT_SUFFIX = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+LLAMA_PROMPT_CACHE_BYTES = int(os.getenv("LLAMA_PROMPT_CACHE_MB", "512")) * 1024 * 1024
+
+# GBNF grammar (llama.cpp json.gbnf) restricting sampling to a JSON object
+JSON_GBNF = r'''
+root   ::= object
+value  ::= object | array | string | number | ("true" | "false" | "null") ws
+object ::= "{" ws ( string ":" ws value ("," ws string ":" ws value)* )? "}" ws
+array  ::= "[" ws ( value ("," ws value)* )? "]" ws
+string ::= "\"" ( [^"\\] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F]) )* "\"" ws
+number ::= ("-"? ([0-9] | [1-9] [0-9]*)) ("." [0-9]+)? ([eE] [-+]? [0-9]+)? ws
+ws     ::= ([ \t\n] ws)?
+'''
+
 class LlamaLocalProvider(LLMProvider):
-    def __init__(self, model_path: str):
+    # One llama.cpp context decodes one prompt at a time
+    max_concurrency = 1
+
+    def __init__(self, model_path: str, **llama_kwargs):
         if Llama is None:
             raise ImportError("llama-cpp-python is not installed.")
 
-        print(f"Loading local model from {model_path}...")
-        self.llm = Llama(
-            model_path=model_path,
-            n_gpu_layers=-1,
-            n_ctx=4096,
-            verbose=False
-        )
+        # Throughput-oriented defaults: large prefill batches, all cores for
+        # CPU-side work, flash attention with the KV cache kept on the GPU.
+        # Any of these can be overridden through LLMFactory.get_provider(...)
+        n_threads = max(1, os.cpu_count() or 8)
+        params = {
+            "n_gpu_layers": -1,
+            "n_ctx": 4096,
+            "n_batch": 2048,
+            "n_ubatch": 512,
+            "n_threads": n_threads,
+            "n_threads_batch": n_threads,
+            "flash_attn": True,
+            "offload_kqv": True,
+            "use_mmap": True,
+            "use_mlock": True,
+            "logits_all": False,
+            "verbose": False,
+        }
+        params.update(llama_kwargs)
+
+        log.info("Loading local model from %s...", model_path)
+        self.llm = Llama(model_path=model_path, **params)
+        # Prompt (KV) cache: calls sharing the LLAMA3_USER_PREFIX header and
+        # any longer common prefix skip re-prefilling it
+        self.llm.set_cache(LlamaRAMCache(capacity_bytes=LLAMA_PROMPT_CACHE_BYTES))
         self._model_path = model_path
+        # All decoding runs on one dedicated thread: the llama.cpp context is
+        # not thread-safe, and callers (asyncio.to_thread, batch helpers) just
+        # queue work and wait on the future
+        self._inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama-inference")
+
+        # Static chat scaffolding is tokenized once; only the user prompt is
+        # tokenized per call (special=False so prompt text can't inject control tokens)
+        self._prefix_tokens = self.llm.tokenize(LLAMA3_USER_PREFIX.encode("utf-8"), add_bos=False, special=True)
+        self._suffix_tokens = self.llm.tokenize(LLAMA3_ASSISTANT_SUFFIX.encode("utf-8"), add_bos=False, special=True)
+
+        # Grammar-constrained decoding: every JSON completion parses first time
+        self._json_grammar = LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+
+    def _prompt_tokens(self, prompt: str) -> List[int]:
+        body = self.llm.tokenize(prompt.encode("utf-8"), add_bos=False, special=False)
+        return self._prefix_tokens + body + self._suffix_tokens
+
+    def _complete(self, prompt: str, **params) -> str:
+        def _run():
+            return self.llm(self._prompt_tokens(prompt), **params)
+
+        output = self._inference_executor.submit(_run).result()
+        return output["choices"][0]["text"].strip()
 
     @property
     def provider_name(self) -> str:
         return f"Local Llama ({os.path.basename(self._model_path)})"
 
+    @llm_cache
     def generate_text(self, prompt: str, **kwargs) -> str:
-        formatted_prompt = (
-            "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
-            f"{prompt}"
-            "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
-        )
-
-        output = self.llm(
-            formatted_prompt,
+        return self._complete(
+            prompt,
             max_tokens=512,
             stop=["<|eot_id|>"],
             echo=False
         )
-        return output["choices"][0]["text"].strip()
 
-    def generate_json(self, prompt: str) -> Dict[str, Any]:
-        json_prompt = prompt + "\n\nRespond strictly with valid JSON."
-        formatted_prompt = (
-            "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
-            f"{json_prompt}"
-            "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
-        )
-
-        output = self.llm(
-            formatted_prompt,
-            max_tokens=512,
+    @llm_cache
+    def generate_json(self, prompt: str, max_tokens: int = 256, **kwargs) -> Dict[str, Any]:
+        # The grammar already forces valid JSON, so no "respond with JSON"
+        # suffix is needed; parsing below is only a safety net. A capped
+        # object is cut mid-way and parses to {}, so callers with larger
+        # outputs (graph extraction) raise max_tokens
+        text = self._complete(
+            prompt,
+            max_tokens=max_tokens,
+            # Greedy decoding: deterministic (cache-friendly) and skips sampler work
+            temperature=0.0,
+            top_k=1,
+            top_p=1.0,
+            repeat_penalty=1.0,
             stop=["<|eot_id|>"],
-            echo=False
+            echo=False,
+            grammar=self._json_grammar
         )
 
-        return self._parse_json(output["choices"][0]["text"].strip())
-
-    def _parse_json(self, text: str) -> Dict[str, Any]:
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            start = text.find("{")
-            end = text.rfind("}") + 1
-            if start != -1 and end != -1:
-                try:
-                    return json.loads(text[start:end])
-                except Exception:
-                    pass
-            return {}
+        return parse_json_response(text)
 
 
 # -------------------------------
@@ -331,16 +652,29 @@ class LlamaLocalProvider(LLMProvider):
 
 class LLMFactory:
     _instances = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_or_create(key: str, builder) -> LLMProvider:
+        # Double-checked so concurrent cold starts never build a provider twice
+        # (a second LlamaLocalProvider would load the GGUF weights again)
+        instance = LLMFactory._instances.get(key)
+        if instance is None:
+            with LLMFactory._lock:
+                instance = LLMFactory._instances.get(key)
+                if instance is None:
+                    instance = builder()
+                    LLMFactory._instances[key] = instance
+        return instance
 
     @staticmethod
     def get_provider(provider_type: str, **kwargs) -> LLMProvider:
         if provider_type == "gemini":
-            if "gemini" not in LLMFactory._instances:
-                LLMFactory._instances["gemini"] = GeminiProvider()
-            return LLMFactory._instances["gemini"]
+            return LLMFactory._get_or_create("gemini", GeminiProvider)
 
         elif provider_type == "llama_local":
-            model_path = kwargs.get(
+            llama_kwargs = dict(kwargs)
+            model_path = llama_kwargs.pop(
                 "model_path",
                 os.path.join(
                     os.getcwd(),
@@ -348,15 +682,12 @@ class LLMFactory:
                 )
             )
 
+            # Instances are keyed by model path only; overrides apply on first load
             key = f"llama_{model_path}"
-            if key not in LLMFactory._instances:
-                LLMFactory._instances[key] = LlamaLocalProvider(model_path)
-            return LLMFactory._instances[key]
+            return LLMFactory._get_or_create(key, lambda: LlamaLocalProvider(model_path, **llama_kwargs))
 
         elif provider_type == "groq":
-            if "groq" not in LLMFactory._instances:
-                LLMFactory._instances["groq"] = GroqProvider()
-            return LLMFactory._instances["groq"]
+            return LLMFactory._get_or_create("groq", GroqProvider)
 
 
 
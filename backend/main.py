@@ -1,13 +1,33 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from backend.memory_manager import MemoryManager
 from backend.pipeline import Pipeline
 from backend.models import ChatRequest, ChatResponse
+from backend import database
 from backend.database import get_db_connection
 import uvicorn
+import asyncio
 import json
+import orjson
 import uuid
+import os
+import queue
+import logging
+import logging.handlers
+
+# Request handlers only enqueue records; formatting and stdout writes happen
+# on the listener thread so logging never blocks the event loop.
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+log = logging.getLogger(__name__)
 
 # Global instances
 memory_manager = None
@@ -17,25 +37,30 @@ pipeline = None
 async def lifespan(app: FastAPI):
     # Startup
     global memory_manager, pipeline
-    print("Initializing memory manager...")
+    _log_listener.start()
+    log.info("Initializing memory manager...")
     memory_manager = MemoryManager()
+    await memory_manager.connect()
     pipeline = Pipeline(memory_manager)
+    pipeline.start_update_worker()
     
-    print("Initializing Database Pool...")
-    from backend.database import init_pool, close_pool, init_db
-    await init_pool()
-    await init_db()
+    log.info("Initializing Database Pool...")
+    await database.init_pool()
+    await database.init_db()
     
     yield
     # Shutdown
-    print("Closing memory manager...")
+    log.info("Closing memory manager...")
+    if pipeline:
+        await pipeline.stop_update_worker()
     if memory_manager:
-        memory_manager.close()
+        await memory_manager.close()
     
-    print("Closing Database Pool...")
-    await close_pool()
+    log.info("Closing Database Pool...")
+    await database.close_pool()
+    _log_listener.stop()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS Configuration
 app.add_middleware(
@@ -46,21 +71,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
-    if not pipeline:
-        raise HTTPException(status_code=500, detail="Pipeline not initialized")
-    
-    # Process turn (Steps 1-5)
-    response = await pipeline.process_turn(request.message, request.user_id, request.conversation_id)
-    
+async def _finish_turn(request: ChatRequest, response: ChatResponse):
+    """Post-response work shared by /chat and /chat/stream: title generation and Step 6 scheduling."""
     # Generate title for new conversations (inline, not async polling)
     if request.conversation_id:
         try:
-            async with await get_db_connection() as conn:
+            async with get_db_connection() as conn:
                 row = await conn.fetchrow('SELECT title FROM conversations WHERE id = $1', request.conversation_id)
                 if row and row['title'] == "New Chat":
-                    import asyncio
                     title_prompt = f"""Generate a short, concise title (max 6 words) for this chat conversation.
 User: "{request.message}"
 Assistant: "{response.response[:200]}"
@@ -71,100 +89,126 @@ Output ONLY the title, nothing else. No quotes."""
                     await conn.execute('UPDATE conversations SET title = $1 WHERE id = $2', title, request.conversation_id)
                     response.title = title
         except Exception as e:
-            print(f"Title generation failed (non-critical): {e}")
+            log.warning("Title generation failed (non-critical): %s", e)
     
-    # Schedule Async Update (Step 6) — memory only, no title generation
-    background_tasks.add_task(
-        pipeline.run_async_update, 
+    # Queue Async Update (Step 6) for the pipeline's worker — memory only, no title generation
+    pipeline.enqueue_update(
         request.message, 
         response.response, 
         request.user_id,
-        response.step_logs.get('step2_retrieval') if response and response.step_logs else None
+        response.step_logs.get('step2_retrieval') if response and response.step_logs else None,
+        retrieved_embeddings=response._retrieved_embeddings
     )
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    if not pipeline:
+        raise HTTPException(status_code=500, detail="Pipeline not initialized")
     
+    # Process turn (Steps 1-5)
+    response = await pipeline.process_turn(request.message, request.user_id, request.conversation_id)
+    await _finish_turn(request, response)
     return response
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Server-sent events: {"type": "token", "text": ...} chunks while the answer is
+    generated, then one {"type": "done", ...ChatResponse fields} event."""
+    if not pipeline:
+        raise HTTPException(status_code=500, detail="Pipeline not initialized")
+    
+    async def event_stream():
+        async for kind, payload in pipeline.stream_turn(request.message, request.user_id, request.conversation_id):
+            if kind == "token":
+                event = {"type": "token", "text": payload}
+            else:
+                await _finish_turn(request, payload)
+                event = {"type": "done", **payload.model_dump()}
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/user")
 async def get_user():
     # Simple user ID generation/retrieval
     # In a real app, this would be handled by auth
     return {"user_id": "user_12345"}
 
-@app.get("/conversations/{user_id}")
-async def get_conversations(user_id: str):
+async def get_db():
+    """Request-scoped pooled connection (FastAPI dependency), released when the request ends."""
+    acquired = False
     try:
-        async with await get_db_connection() as conn:
-            rows = await conn.fetch('''
-                SELECT id, title, created_at, updated_at 
-                FROM conversations 
-                WHERE user_id = $1 
-                ORDER BY updated_at DESC
-            ''', user_id)
-            return [dict(row) for row in rows]
-    except RuntimeError:
-        raise HTTPException(status_code=503, detail="Database is not available")
+        async with get_db_connection() as conn:
+            acquired = True
+            yield conn
+    except RuntimeError as e:
+        # Only the pool being unavailable maps to 503; errors from the handler propagate
+        if acquired:
+            raise
+        raise HTTPException(status_code=503, detail="Database is not available") from e
+
+@app.get("/conversations/{user_id}")
+async def get_conversations(user_id: str, conn=Depends(get_db)):
+    rows = await conn.fetch('''
+        SELECT id, title, created_at, updated_at 
+        FROM conversations 
+        WHERE user_id = $1 
+        ORDER BY updated_at DESC
+    ''', user_id)
+    return [dict(row) for row in rows]
 
 @app.get("/conversations/{conversation_id}/messages")
-async def get_messages(conversation_id: str):
-    try:
-        async with await get_db_connection() as conn:
-            rows = await conn.fetch('''
-                SELECT role, content, metadata, created_at 
-                FROM messages 
-                WHERE conversation_id = $1 
-                ORDER BY created_at ASC
-            ''', conversation_id)
-            
-            # Parse metadata JSON strings back to dicts
-            result = []
-            for row in rows:
-                msg = dict(row)
-                if msg.get('metadata'):
-                    try:
-                        msg['metadata'] = json.loads(msg['metadata'])
-                    except:
-                        msg['metadata'] = {}
-                result.append(msg)
-            return result
-    except RuntimeError:
-        raise HTTPException(status_code=503, detail="Database is not available")
+async def get_messages(conversation_id: str, conn=Depends(get_db)):
+    rows = await conn.fetch('''
+        SELECT role, content, metadata, created_at 
+        FROM messages 
+        WHERE conversation_id = $1 
+        ORDER BY created_at ASC
+    ''', conversation_id)
+    
+    # Parse metadata JSON strings back to dicts
+    result = []
+    for row in rows:
+        msg = dict(row)
+        if msg.get('metadata'):
+            try:
+                msg['metadata'] = json.loads(msg['metadata'])
+            except (TypeError, ValueError):
+                msg['metadata'] = {}
+        result.append(msg)
+    return result
 
 @app.post("/conversations")
-async def create_conversation(request: dict):
-    try:
-        user_id = request.get("user_id")
-        title = request.get("title", "New Chat")
-        async with await get_db_connection() as conn:
-            conversation_id = await conn.fetchval('''
-                INSERT INTO conversations (user_id, title) 
-                VALUES ($1, $2) 
-                RETURNING id
-            ''', user_id, title)
-            return {"id": str(conversation_id), "title": title}
-    except RuntimeError:
-        raise HTTPException(status_code=503, detail="Database is not available")
+async def create_conversation(request: dict, conn=Depends(get_db)):
+    user_id = request.get("user_id")
+    title = request.get("title", "New Chat")
+    conversation_id = await conn.fetchval('''
+        INSERT INTO conversations (user_id, title) 
+        VALUES ($1, $2) 
+        RETURNING id
+    ''', user_id, title)
+    return {"id": str(conversation_id), "title": title}
+
+@app.post("/bootstrap")
+async def bootstrap(request: dict, conn=Depends(get_db)):
+    """/user + POST /conversations in one round-trip: the user id and a fresh conversation."""
+    user_id = (await get_user())["user_id"]
+    conversation = await create_conversation({"user_id": user_id, "title": request.get("title", "New Chat")}, conn)
+    return {"user_id": user_id, "conversation_id": conversation["id"], "title": conversation["title"]}
 
 @app.patch("/conversations/{conversation_id}")
-async def update_conversation_title(conversation_id: str, request: dict):
-    try:
-        title = request.get("title")
-        if not title:
-            raise HTTPException(status_code=400, detail="Title is required")
-            
-        async with await get_db_connection() as conn:
-            await conn.execute('UPDATE conversations SET title = $1 WHERE id = $2', title, conversation_id)
-            return {"id": conversation_id, "title": title}
-    except RuntimeError:
-        raise HTTPException(status_code=503, detail="Database is not available")
+async def update_conversation_title(conversation_id: str, request: dict, conn=Depends(get_db)):
+    title = request.get("title")
+    if not title:
+        raise HTTPException(status_code=400, detail="Title is required")
+        
+    await conn.execute('UPDATE conversations SET title = $1 WHERE id = $2', title, conversation_id)
+    return {"id": conversation_id, "title": title}
 
 @app.delete("/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: str):
-    try:
-        async with await get_db_connection() as conn:
-            await conn.execute('DELETE FROM conversations WHERE id = $1', conversation_id)
-            return {"status": "success"}
-    except RuntimeError:
-        raise HTTPException(status_code=503, detail="Database is not available")
+async def delete_conversation(conversation_id: str, conn=Depends(get_db)):
+    await conn.execute('DELETE FROM conversations WHERE id = $1', conversation_id)
+    return {"status": "success"}
 
 @app.get("/health")
 def health_check():
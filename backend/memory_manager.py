@@ -1,38 +1,189 @@
 import os
+import time
+import asyncio
+import threading
+import uuid
+import hashlib
+import sqlite3
+import logging
 import chromadb
-from neo4j import GraphDatabase
+from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+from contextlib import asynccontextmanager
+from neo4j import AsyncGraphDatabase
 from dotenv import load_dotenv
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# HNSW query-time search breadth per profile (Chroma's own default is 10)
+ANN_PROFILES = {
+    "fast": {"hnsw:search_ef": 32},
+    "balanced": {"hnsw:search_ef": 64},
+    "recall": {"hnsw:search_ef": 128},
+}
+
+# Semantic memory writes are buffered and flushed to Chroma in one add() call
+VECTOR_FLUSH_INTERVAL = 2.0  # seconds
+VECTOR_FLUSH_BATCH = 32      # flush early once this many writes are pending
+
+# Properties the graph is looked up / MERGEd on; indexed at connect() so those
+# lookups are index seeks rather than label scans
+GRAPH_INDEXES = (
+    ("User", "id"),
+    ("Fact", "id"), ("Fact", "statement"),
+    ("Entity", "id"), ("Entity", "name"),
+    ("Preference", "id"), ("Preference", "name"),
+    ("Constraint", "id"), ("Constraint", "name"),
+    ("Instruction", "id"), ("Instruction", "name"),
+    ("Commitment", "id"), ("Commitment", "description"),
+)
+
+def _fill_node_defaults(label, rows):
+    """Gives each property dict an id, valid_from and status if it lacks one."""
+    now = time.time()
+    for properties in rows:
+        # Ensure 'id' is in properties - only generate UUID if not provided
+        if 'id' not in properties:
+            properties['id'] = str(uuid.uuid4())
+            log.debug("Generated UUID for %s: %s", label, properties['id'])
+        
+        # Temporal Metadata Defaults
+        if 'valid_from' not in properties:
+            properties['valid_from'] = now
+        if 'status' not in properties:
+            properties['status'] = 'active'
+
+def enable_chroma_wal(path):
+    """Switches a local Chroma store's SQLite file to WAL journaling.
+    journal_mode is persisted in the file, so Chroma's own connections pick it
+    up and reads no longer wait behind writers (and vice versa)."""
+    db_path = os.path.join(path, "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return
+    try:
+        with sqlite3.connect(db_path) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.Error as e:
+        log.warning("Could not enable WAL on %s: %s", db_path, e)
+
+def content_digest(text):
+    """Hex digest of normalized text, stored as the content_sha metadata key."""
+    return hashlib.blake2b(text.strip().lower().encode(), digest_size=16).hexdigest()
+
 class MemoryManager:
     def __init__(self):
-        # Initialize ChromaDB
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        self.collection = self.chroma_client.get_or_create_collection(name="conversation_memory")
+        # Initialize ChromaDB. With CHROMA_HOST set, only storage and HNSW search
+        # move to a separate `chroma run` server; embeddings are computed here
+        chroma_host = os.getenv("CHROMA_HOST")
+        if chroma_host:
+            self.chroma_client = chromadb.HttpClient(
+                host=chroma_host,
+                port=int(os.getenv("CHROMA_PORT", "8001"))
+            )
+        else:
+            enable_chroma_wal("./chroma_db")
+            self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        # Same all-MiniLM-L6-v2 ONNX model as Chroma's default (so stored vectors
+        # stay compatible), pinned to the CPU provider so it never competes with
+        # llama.cpp for the GPU
+        self.embedding_function = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+        # Optional ANN speed/recall trade-off (HNSW search breadth)
+        ann_profile = os.getenv("CHROMA_ANN_PROFILE")
+        ann_metadata = ANN_PROFILES.get(ann_profile) if ann_profile else None
+        if ann_profile and ann_metadata is None:
+            log.warning(
+                "Unknown CHROMA_ANN_PROFILE %r (expected one of: %s); using Chroma defaults",
+                ann_profile, ", ".join(ANN_PROFILES)
+            )
+        self.collection = self.chroma_client.get_or_create_collection(
+            name="conversation_memory",
+            embedding_function=self.embedding_function,
+            metadata=ann_metadata
+        )
+        # Semantic response cache: past user messages (cosine space) with the
+        # serialized response in metadata
+        self.response_cache = self.chroma_client.get_or_create_collection(
+            name="response_cache",
+            embedding_function=self.embedding_function,
+            metadata={"hnsw:space": "cosine"}
+        )
+
+        # Pending (id, document, metadata, embedding) rows for the next flush
+        self._vector_writes = []
+        self._vector_writes_lock = threading.Lock()
+        self._flush_task = None
 
-        # Initialize Neo4j
+        # Initialize Neo4j (async driver; connectivity is verified in connect())
         self.neo4j_uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
         self.neo4j_user = os.getenv("NEO4J_USER", "neo4j")
         self.neo4j_password = os.getenv("NEO4J_PASSWORD", "password")
         
         try:
-            self.driver = GraphDatabase.driver(
+            self.driver = AsyncGraphDatabase.driver(
                 self.neo4j_uri, 
                 auth=(self.neo4j_user, self.neo4j_password)
             )
-            # Verify connection
-            self.driver.verify_connectivity()
-            print("Connected to Neo4j.")
         except Exception as e:
-            print(f"Failed to connect to Neo4j: {e}. Running in Mock Mode for Graph DB.")
+            log.warning("Failed to connect to Neo4j: %s. Running in Mock Mode for Graph DB.", e)
             self.driver = None
 
-    def close(self):
+    async def connect(self):
+        """Starts the vector write flusher and verifies the Neo4j connection,
+        falling back to Mock Mode if it is unreachable."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._periodic_flush())
+        if not self.driver:
+            return
+        try:
+            await self.driver.verify_connectivity()
+            log.info("Connected to Neo4j.")
+        except Exception as e:
+            log.warning("Failed to connect to Neo4j: %s. Running in Mock Mode for Graph DB.", e)
+            await self.driver.close()
+            self.driver = None
+            return
+        await self.ensure_graph_indexes()
+
+    async def ensure_graph_indexes(self):
+        """Creates the lookup indexes in GRAPH_INDEXES (no-op if they exist)."""
+        try:
+            async with self.graph_session() as s:
+                for label, prop in GRAPH_INDEXES:
+                    name = f"{label.lower()}_{prop}"
+                    result = await s.run(f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})")
+                    await result.consume()
+        except Exception as e:
+            log.warning("Failed to create graph indexes: %s", e)
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # Drain whatever is still buffered
+        await asyncio.to_thread(self.flush_vector_writes)
         if self.driver:
-            self.driver.close()
+            await self.driver.close()
 
-    def ensure_user_exists(self, user_id):
+    async def _periodic_flush(self):
+        while True:
+            await asyncio.sleep(VECTOR_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.flush_vector_writes)
+            except Exception as e:
+                log.error("Vector write flush failed: %s", e)
+
+    @asynccontextmanager
+    async def graph_session(self, session=None):
+        """Yields the given session, or opens one for the block so several graph
+        operations share a single pooled connection. Yields None in Mock Mode."""
+        if session is not None or not self.driver:
+            yield session
+            return
+        async with self.driver.session() as new_session:
+            yield new_session
+
+    async def ensure_user_exists(self, user_id, session=None):
         """Ensures a User node exists in the graph database."""
         if not self.driver:
             return
@@ -43,122 +194,304 @@ class MemoryManager:
         RETURN u
         """
         try:
-            with self.driver.session() as session:
-                session.run(query, user_id=user_id)
-                print(f"DEBUG: User node ensured for {user_id}")
+            async with self.graph_session(session) as s:
+                result = await s.run(query, user_id=user_id)
+                await result.consume()
+                log.debug("User node ensured for %s", user_id)
+        except Exception as e:
+            log.error("Failed to ensure user exists: %s", e)
+
+    def embed(self, texts):
+        """Embeds texts with the collection's embedding function."""
+        return self.embedding_function(list(texts))
+
+    def add_vector_memory(self, turn_id, text, metadata=None, embedding=None):
+        """Queues a conversation turn for ChromaDB; it is written by the next
+        batched flush. A precomputed embedding skips re-embedding."""
+        metadata = dict(metadata or {})
+        metadata["content_sha"] = content_digest(text)
+        if embedding is None:
+            embedding = self.embed([text])[0]
+        with self._vector_writes_lock:
+            self._vector_writes.append((str(turn_id), text, metadata, embedding))
+            pending = len(self._vector_writes)
+        if pending >= VECTOR_FLUSH_BATCH:
+            self.flush_vector_writes()
+
+    def flush_vector_writes(self):
+        """Writes all queued turns to ChromaDB in a single add() call."""
+        with self._vector_writes_lock:
+            rows, self._vector_writes = self._vector_writes, []
+        if not rows:
+            return
+        try:
+            self._write_vector_rows(rows)
         except Exception as e:
-            print(f"ERROR: Failed to ensure user exists: {e}")
+            # Put the rows back ahead of anything queued since, for the next flush
+            with self._vector_writes_lock:
+                self._vector_writes = rows + self._vector_writes
+            log.error("Vector write flush failed, %d row(s) requeued: %s", len(rows), e)
 
-    def add_vector_memory(self, turn_id, text, metadata=None):
-        """Adds a conversation turn to ChromaDB."""
-        if metadata is None:
-            metadata = {}
+    def _write_vector_rows(self, rows):
+        # Drop exact repeats (same normalized text) of stored or batched turns;
+        # content_sha is a metadata filter, so no collection scan is needed
+        shas = list({metadata["content_sha"] for _, _, metadata, _ in rows})
+        stored = self.collection.get(where={"content_sha": {"$in": shas}}, include=["metadatas"])
+        seen = {m["content_sha"] for m in stored["metadatas"] or []}
+        unique_rows = []
+        for row in rows:
+            sha = row[2]["content_sha"]
+            if sha not in seen:
+                seen.add(sha)
+                unique_rows.append(row)
+        if len(unique_rows) < len(rows):
+            log.debug("Skipped %d duplicate vector write(s)", len(rows) - len(unique_rows))
+        if not unique_rows:
+            return
+        ids, documents, metadatas, embeddings = (list(column) for column in zip(*unique_rows))
         self.collection.add(
-            documents=[text],
-            metadatas=[metadata],
-            ids=[str(turn_id)]
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=embeddings
         )
+        log.debug("Flushed %d vector write(s) to ChromaDB", len(ids))
 
-    def search_vector_memory(self, query, n_results=3):
+    def search_vector_memory(self, query, n_results=3, query_embedding=None):
         """Retrieves similar past conversations from ChromaDB."""
+        if query_embedding is not None:
+            return self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results
+            )
         results = self.collection.query(
             query_texts=[query],
             n_results=n_results
         )
         return results
 
-    def run_graph_query(self, cypher_query, parameters=None):
+    def search_vector_memory_batch(self, queries, n_results=3):
+        """Retrieves similar past conversations for several queries in one ChromaDB call.
+        Results are parallel lists indexed by query position."""
+        if not queries:
+            return {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        return self.collection.query(
+            query_texts=list(queries),
+            n_results=n_results,
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
+
+    def lookup_cached_response(self, user_id, message, max_distance, ttl):
+        """Returns the serialized response cached for a near-identical message from
+        this user (cosine distance <= max_distance, younger than ttl seconds), or None."""
+        hit = self.response_cache.query(
+            query_texts=[message],
+            n_results=1,
+            where={"user_id": user_id},
+            include=["metadatas", "distances"]
+        )
+        if not hit['ids'] or not hit['ids'][0]:
+            return None
+        distance = hit['distances'][0][0]
+        metadata = hit['metadatas'][0][0]
+        if distance > max_distance:
+            return None
+        if time.time() - metadata.get('created_at', 0) > ttl:
+            # Expired rows would keep winning the nearest-neighbour tie; drop them
+            self.response_cache.delete(ids=hit['ids'][0])
+            return None
+        return metadata.get('response')
+
+    def cache_response(self, user_id, message, response_json):
+        """Stores a serialized response for semantic lookup by lookup_cached_response.
+        The id is derived from the user and normalized message, so repeats overwrite."""
+        self.response_cache.upsert(
+            documents=[message],
+            metadatas=[{"user_id": user_id, "response": response_json, "created_at": time.time()}],
+            ids=[content_digest(f"{user_id}\n{message}")]
+        )
+
+    def invalidate_cached_responses(self, user_id):
+        """Drops a user's cached responses (their long-term memory changed)."""
+        self.response_cache.delete(where={"user_id": user_id})
+
+    async def run_graph_query(self, cypher_query, parameters=None, session=None):
         """Executes a Cypher query on Neo4j."""
         if not self.driver:
             return []
         
-        with self.driver.session() as session:
-            result = session.run(cypher_query, parameters)
-            return [record.data() for record in result]
+        async with self.graph_session(session) as s:
+            result = await s.run(cypher_query, parameters)
+            return [record.data() async for record in result]
 
-    def add_graph_node(self, label, properties):
+    async def add_graph_node(self, label, properties, session=None):
         """Adds a node to the Neo4j graph."""
+        await self.add_graph_nodes(label, [properties], session=session)
+
+    async def add_graph_nodes(self, label, rows, session=None):
+        """Merges several nodes of one label in a single UNWIND write.
+        Each row is a property dict; a missing 'id' is generated in place."""
         if not self.driver:
-            print("DEBUG: Neo4j driver not available, skipping node creation")
+            log.debug("Neo4j driver not available, skipping node creation")
+            return
+        if not rows:
             return
         
-        # Ensure 'id' is in properties - only generate UUID if not provided
-        if 'id' not in properties:
-            import uuid
-            properties['id'] = str(uuid.uuid4())
-            print(f"DEBUG: Generated UUID for {label}: {properties['id']}")
-        
-        # Temporal Metadata Defaults
-        import time
-        if 'valid_from' not in properties:
-            properties['valid_from'] = time.time()
-        if 'status' not in properties:
-            properties['status'] = 'active'
+        _fill_node_defaults(label, rows)
         
-        def _create_node(tx, label, props):
+        async def _create_nodes(tx, label, batch):
             # Use label-specific MERGE with ID
-            query = f"MERGE (n:{label} {{id: $id}}) SET n += $props RETURN n"
-            print(f"DEBUG: Executing query: {query} with id={props['id']}")
-            result = tx.run(query, id=props['id'], props=props)
-            record = result.single()
-            return record
+            query = f"UNWIND $rows AS r MERGE (n:{label} {{id: r.id}}) SET n += r.props"
+            log.debug("Executing query: %s with %d row(s)", query, len(batch))
+            result = await tx.run(query, rows=batch)
+            return await result.consume()
         
+        batch = [{"id": p['id'], "props": p} for p in rows]
         try:
-            with self.driver.session() as session:
-                result = session.execute_write(_create_node, label, properties)
-                print(f"DEBUG: Successfully updated/created node: {label} with id={properties['id']}")
+            async with self.graph_session(session) as s:
+                await s.execute_write(_create_nodes, label, batch)
+                log.debug("Successfully updated/created %d %s node(s)", len(batch), label)
         except Exception as e:
-            print(f"ERROR: Failed to create node {label}: {e}")
+            log.error("Failed to create nodes %s: %s", label, e)
 
-    def supersede_node(self, old_node_id, new_node_id, label):
+    async def merge_user_nodes(self, user_id, label, key_field, rows, update_on_match=False, session=None):
+        """Idempotently MERGEs the user's active nodes of one label on a natural
+        key (e.g. Fact.statement) in a single UNWIND write, linking new ones with
+        HAS_<LABEL>. Returns the set of keys that already existed."""
+        if not self.driver:
+            return set()
+        rows = [p for p in rows if p.get(key_field)]
+        if not rows:
+            return set()
+        
+        _fill_node_defaults(label, rows)
+        on_match = "SET n += r.match_props" if update_on_match else "SET n.updated_at = timestamp()"
+        query = f"""
+        UNWIND $rows AS r
+        MATCH (u:User {{id: $uid}})
+        MERGE (u)-[:HAS_{label.upper()}]->(n:{label} {{{key_field}: r.key, status: 'active'}})
+        ON CREATE SET n += r.props
+        ON MATCH {on_match}
+        RETURN r.key AS key, n.id <> r.props.id AS existed
+        """
+        batch = [
+            {"key": p[key_field], "props": p,
+             "match_props": {k: v for k, v in p.items() if k not in ('id', 'valid_from')}}
+            for p in rows
+        ]
+        try:
+            async with self.graph_session(session) as s:
+                result = await s.run(query, rows=batch, uid=user_id)
+                return {record["key"] async for record in result if record["existed"]}
+        except Exception as e:
+            log.error("Failed to merge %s nodes: %s", label, e)
+            return set()
+
+    async def add_user_nodes(self, user_id, label, rows, supersede_key=None, session=None):
+        """Merges the user's new nodes of one label and links them with
+        HAS_<LABEL> in a single UNWIND write. With supersede_key, the user's
+        active nodes sharing that key are marked obsolete and SUPERSEDED by the
+        new node in the same statement. Returns the keys that superseded one."""
+        if not self.driver:
+            log.debug("Neo4j driver not available, skipping node creation")
+            return set()
+        if not rows:
+            return set()
+        
+        _fill_node_defaults(label, rows)
+        rel = f"HAS_{label.upper()}"
+        if supersede_key:
+            # Old versions are matched before the new node exists; a null key matches nothing
+            find_old = (
+                f"OPTIONAL MATCH (u)-[:{rel}]->(old:{label} {{{supersede_key}: r.key, status: 'active'}}) "
+                f"WITH u, r, collect(old) AS olds"
+            )
+        else:
+            find_old = "WITH u, r, [] AS olds"
+        query = f"""
+        UNWIND $rows AS r
+        MATCH (u:User {{id: $uid}})
+        {find_old}
+        MERGE (n:{label} {{id: r.props.id}})
+        SET n += r.props
+        MERGE (u)-[:{rel}]->(n)
+        WITH r, n, [o IN olds WHERE o.id <> n.id] AS olds
+        FOREACH (old IN olds |
+            SET old.status = 'obsolete', old.valid_until = $now
+            MERGE (n)-[s:SUPERSEDES]->(old)
+            SET s.timestamp = $now
+        )
+        RETURN r.key AS key, size(olds) > 0 AS superseded
+        """
+        batch = [{"key": p.get(supersede_key) if supersede_key else None, "props": p} for p in rows]
+        try:
+            async with self.graph_session(session) as s:
+                result = await s.run(query, rows=batch, uid=user_id, now=time.time())
+                return {record["key"] async for record in result if record["superseded"]}
+        except Exception as e:
+            log.error("Failed to create nodes %s: %s", label, e)
+            return set()
+
+    async def supersede_node(self, old_node_id, new_node_id, label, session=None):
         """Marks old node as obsolete and links new node to it with SUPERSEDES."""
+        await self.supersede_nodes(label, [(old_node_id, new_node_id)], session=session)
+
+    async def supersede_nodes(self, label, pairs, session=None):
+        """Applies several (old_id, new_id) supersessions of one label in a
+        single UNWIND write."""
         if not self.driver: return
+        if not pairs:
+            return
         
-        import time
         now = time.time()
         
         query = f"""
-        MATCH (old:{label} {{id: $old_id}})
-        MATCH (new:{label} {{id: $new_id}})
+        UNWIND $pairs AS p
+        MATCH (old:{label} {{id: p.old_id}})
+        MATCH (new:{label} {{id: p.new_id}})
         SET old.status = 'obsolete', old.valid_until = $now
         MERGE (new)-[r:SUPERSEDES]->(old)
         SET r.timestamp = $now
-        RETURN new, old
         """
+        rows = [{"old_id": old_id, "new_id": new_id} for old_id, new_id in pairs]
         try:
-            with self.driver.session() as session:
-                session.run(query, old_id=old_node_id, new_id=new_node_id, now=now)
-                print(f"DEBUG: Node {new_node_id} now SUPERSEDES {old_node_id}")
+            async with self.graph_session(session) as s:
+                result = await s.run(query, pairs=rows, now=now)
+                await result.consume()
+                log.debug("Applied %d %s supersession(s)", len(rows), label)
         except Exception as e:
-            print(f"ERROR in supersede_node: {e}")
+            log.error("supersede_nodes failed: %s", e)
 
-    def create_relationship(self, source_label, source_id, rel_type, target_label, target_id, rel_props=None):
+    async def create_relationship(self, source_label, source_id, rel_type, target_label, target_id, rel_props=None, session=None):
         """Creates a relationship between two nodes."""
+        rows = [{"s": source_id, "t": target_id, "props": rel_props or {}}]
+        await self.create_relationships(source_label, rel_type, target_label, rows, session=session)
+
+    async def create_relationships(self, source_label, rel_type, target_label, rows, session=None):
+        """Merges several relationships of one (source, type, target) shape in a
+        single UNWIND write. Rows are {"s": source_id, "t": target_id, "props": {...}}."""
         if not self.driver:
-            print("DEBUG: Neo4j driver not available, skipping relationship creation")
+            log.debug("Neo4j driver not available, skipping relationship creation")
+            return
+        if not rows:
             return
-
-        if rel_props is None:
-            rel_props = {}
         
-        def _create_rel(tx, src_label, src_id, r_type, tgt_label, tgt_id, r_props):
+        async def _create_rels(tx, batch):
             query = (
-                f"MATCH (a:{src_label} {{id: $source_id}}), (b:{tgt_label} {{id: $target_id}}) "
-                f"MERGE (a)-[r:{r_type}]->(b) "
-                f"SET r += $props "
-                f"RETURN r"
+                f"UNWIND $rows AS r "
+                f"MATCH (a:{source_label} {{id: r.s}}), (b:{target_label} {{id: r.t}}) "
+                f"MERGE (a)-[x:{rel_type}]->(b) "
+                f"SET x += r.props"
             )
-            print(f"DEBUG: Executing relationship query: {query}")
-            result = tx.run(query, source_id=src_id, target_id=tgt_id, props=r_props)
-            record = result.single()
-            print(f"DEBUG: Relationship creation result: {record}")
-            return record
+            log.debug("Executing relationship query: %s", query)
+            result = await tx.run(query, rows=batch)
+            summary = await result.consume()
+            log.debug("Relationship creation result: %s", summary.counters)
+            return summary
         
         try:
-            with self.driver.session() as session:
-                result = session.execute_write(_create_rel, source_label, source_id, rel_type, target_label, target_id, rel_props)
-                print(f"DEBUG: Successfully created relationship: {source_label}({source_id})-[{rel_type}]->{target_label}({target_id})")
+            async with self.graph_session(session) as s:
+                await s.execute_write(_create_rels, rows)
+                log.debug("Successfully created %d relationship(s): %s-[%s]->%s", len(rows), source_label, rel_type, target_label)
         except Exception as e:
-            print(f"ERROR: Failed to create relationship: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Failed to create relationships: %s", e)
@@ -1,7 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 from typing import List, Optional, Dict, Any
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     message: str
     user_id: str = "user_1"
     conversation_id: Optional[str] = None
@@ -12,3 +14,7 @@ class ChatResponse(BaseModel):
     step_logs: Optional[Dict[str, Any]] = None
     grounding_metadata: Optional[Dict[str, Any]] = None
     title: Optional[str] = None
+
+    # Embeddings of step_logs['step2_retrieval']['vector'], handed to the
+    # Step 6 update in-process; private so they are never serialized
+    _retrieved_embeddings: Optional[List[Any]] = PrivateAttr(default=None)
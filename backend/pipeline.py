@@ -1,34 +1,361 @@
 import os
-import json
+import re
+import time
+import logging
 import asyncio
+from collections import defaultdict
+from functools import cached_property
 from backend.memory_manager import MemoryManager
 from backend.models import ChatResponse
 from backend.llm_factory import LLMFactory, LLMProvider
-import difflib
-from difflib import SequenceMatcher
+import numpy as np
+import orjson
 from backend.database import get_db_connection
 
+log = logging.getLogger(__name__)
+
+def _pretty_json(value) -> str:
+    """Indented JSON for debug logs (orjson; non-JSON values fall back to str)."""
+    return orjson.dumps(value, option=orjson.OPT_INDENT_2, default=str).decode()
+
+try:
+    from numba import njit
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+
+
+def _dedup_keep_mask_py(S, threshold):
+    """Greedy dedup over a similarity matrix: keep i unless an earlier kept row is too similar."""
+    n = S.shape[0]
+    keep = np.zeros(n, dtype=np.bool_)
+    taken = np.zeros(n, dtype=np.bool_)
+    for i in range(n):
+        if taken[i]:
+            continue
+        keep[i] = True
+        taken |= S[i] > threshold
+    return keep
+
+if _NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _dedup_keep_mask(S, threshold):
+        n = S.shape[0]
+        keep = np.zeros(n, dtype=np.bool_)
+        taken = np.zeros(n, dtype=np.bool_)
+        for i in range(n):
+            if taken[i]:
+                continue
+            keep[i] = True
+            for j in range(i + 1, n):
+                if S[i, j] > threshold:
+                    taken[j] = True
+        return keep
+else:
+    _dedup_keep_mask = _dedup_keep_mask_py
+
+# Every active node of the user, grouped by type. Parameterized so Neo4j
+# caches one execution plan for all users and turns.
+COMPREHENSIVE_USER_QUERY = """
+MATCH (u:User {id: $user_id})
+OPTIONAL MATCH (u)-[:HAS_PREFERENCE]->(pref:Preference {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_FACT]->(fact:Fact {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_ENTITY]->(entity:Entity {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_CONSTRAINT]->(constraint:Constraint {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_COMMITMENT]->(commitment:Commitment {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_INSTRUCTION]->(instruction:Instruction {status: 'active'})
+RETURN 
+    collect(DISTINCT pref) as preferences,
+    collect(DISTINCT fact) as facts,
+    collect(DISTINCT entity) as entities,
+    collect(DISTINCT constraint) as constraints,
+    collect(DISTINCT commitment) as commitments,
+    collect(DISTINCT instruction) as instructions
+"""
+
+# Cosine similarity above which a new semantic memory duplicates a retrieved one
+# (same cut-off as Chroma's squared-L2 < 0.5 on normalized MiniLM vectors)
+VECTOR_DUPLICATE_COSINE = 0.75
+
+# Step 6 runs on a background worker fed by a bounded queue
+UPDATE_QUEUE_SIZE = 256
+UPDATE_WORKER_BATCH = 8       # queued updates picked up per worker iteration
+UPDATE_DRAIN_TIMEOUT = 30.0   # seconds to finish queued updates on shutdown
+
+# Fallback/error replies that must never be written to memory, matched in one pass
+ERROR_SIGNATURE_RE = re.compile("|".join(map(re.escape, (
+    "Thinking process interrupted",
+    "I'm currently experiencing system issues.",
+    "Error during processing.",
+    "System limited",
+))))
+
+# User turns that are nothing but a greeting/acknowledgement carry no memory,
+# so Step 6 skips both LLM calls for them. Deliberately conservative: a short
+# message can still be a fact ("I'm vegan"), and yes/no may answer a question.
+TRIVIAL_TURN_RE = re.compile(
+    r"\s*(?:(?:ok(?:ay)?|k|thanks?(?: you)?|thx|ty|hi|hello|hey|bye|goodbye|lol|cool|nice|great)[\s!.?,]*)+",
+    re.IGNORECASE
+)
+
+# Result columns of COMPREHENSIVE_USER_QUERY
+GRAPH_NODE_KEYS = ('preferences', 'facts', 'entities', 'constraints', 'commitments', 'instructions')
+
+# Natural key the Memory Gardener dedups each node label on
+GRAPH_DEDUP_KEYS = {
+    'Fact': 'statement',
+    'Entity': 'name',
+    'Preference': 'name',
+    'Constraint': 'name',
+    'Instruction': 'name',
+    'Commitment': 'description',
+}
+
+# -------------------------------
+# Prompt templates
+# -------------------------------
+# Static instructions come first and per-turn data is appended last, so the
+# prefix is byte-identical across calls and provider/llama.cpp prefix caches hit.
+
+TEMPORAL_PLANNER_PROMPT = """Analyze the user message for any overrides or updates to previous preferences or schedules.
+
+Task:
+1. Is the user correcting or updating something they might have said before? (e.g., "instead", "wait", "actually", "change to")
+2. Identify the target entity type (User, Preference, Event).
+
+Output JSON:
+{
+    "is_override": boolean,
+    "target_node_label": "User|Preference|Event|null",
+    "conflict_summary": "string|null"
+}
+"""
+
+PLANNER_PROMPT_PREFIX = """Analyze the user message given at the end.
+Identify core entities and decide if external search is TRULY needed.
+
+Instructions:
+1. **SEARCH POLICY**: 
+   - Set `needs_search` to `true` ONLY if the user asks for real-time data (weather, stocks, news and other stuff) or very specific recent events or for information through internet sources.
+   - Set `needs_search` to `false` for general knowledge (history, science, coding), opinions, or questions about the user's own data for which you are sure that the net LLM would have data in training.
+   - DO NOT search if the info might be in the long-term memory (Graph/Vector).
+
+2. **Graph/Vector Query**:
+   - Always generate `search_terms` for the vector DB (semantic memory).
+   - Always generate a `cypher_query` for the graph DB.
+   - Query for ACTIVE nodes only (status: 'active').
+
+Output JSON:
+{
+    "search_terms": ["term1", "term2"], 
+    "cypher_query": "MATCH ... RETURN ...", 
+    "needs_search": boolean,
+    "reasoning": "why search is needed or not"
+}
+
+Example Query: 
+MATCH (u:User {id: $user_id})
+OPTIONAL MATCH (u)-[:HAS_PREFERENCE]->(p:Preference {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_CONSTRAINT]->(c:Constraint {status: 'active'})
+OPTIONAL MATCH (u)-[:HAS_FACT]->(f:Fact {status: 'active'})
+RETURN p, c, f
+"""
+
+SYNTHESIS_PROMPT_PREFIX = """You are a Context Distiller. Your ONLY job is to output a short bullet-point summary of relevant context for another AI to use when responding.
+
+OUTPUT RULES:
+- Output ONLY a short bullet-point list of facts relevant to the user's current message and relevant preferences,facts.
+- DO NOT answer the user's question yourself
+- DO NOT generate code, explanations, or any response content
+- DO NOT analyze or reason about the context
+- Keep it under 5 bullet points
+- If no memory is relevant, just say "No relevant context."
+"""
+
+RESPONSE_PROMPT_PREFIX = """You are a helpful AI assistant with long-term memory. You remember things about the user from previous conversations.
+
+Instructions:
+- Respond directly and helpfully to the user's message
+- Use what you remember to personalize your response (e.g. if they prefer Rust, write code in Rust without being asked)
+- Do NOT explain your reasoning or analysis process
+- Do NOT mention "memory", "context", "database" or internal systems
+- Respond as if you naturally remember these things
+- Be concise and directly address what the user asked for
+"""
+
+DIRECT_RESPONSE_PROMPT_PREFIX = """You are a helpful AI assistant with long-term memory.
+
+Instructions:
+- Respond naturally and helpfully to the user's message
+- Use your memory to personalize your response (e.g. if they prefer Rust, give code in Rust)
+- If the user is updating a fact, acknowledge the update
+- NEVER mention "memory", "context", "graph database", or internal systems to the user
+- Respond as if you naturally remember these things about them
+- Be concise and directly address what the user asked for
+"""
+
+SEMANTIC_FILTER_PROMPT_PREFIX = """You are a Memory Filter in a long-term memory system for an AI assistant.
+Your job is to decide if the conversation turn given at the end contains USER-SPECIFIC information worth remembering across future conversations.
+
+SAVE ONLY user-specific information such as:
+- Personal preferences ("I prefer Rust", "I'm vegetarian")
+- Facts about the user ("My name is Adi", "I work at Google", "My best friend is Tobey")
+- Constraints they set ("Never use emojis", "Keep responses short")
+- Long-term instructions ("Always explain with analogies")
+- Important personal context ("I'm preparing for an interview next week")
+
+DO NOT SAVE:
+- General knowledge the AI generated (code examples, explanations, tutorials)
+- The content of what the assistant produced (a web server program, a poem, etc.)
+- Information that any AI would already know (how Rust works, what actix-web is)
+- Simple task completions ("User asked for X, assistant provided X")
+
+Output JSON:
+- meaningful_content: (boolean) true ONLY if there is user-specific info to remember
+- summary: (string) a short summary of the USER-SPECIFIC info only, or null
+- reasoning: (string) why this is or isn't user-specific
+
+Examples:
+User: "I prefer Rust" → SAVE: "User prefers Rust for coding examples"
+User: "Write me a web server" → SKIP (general task, nothing personal to remember)
+User: "My meeting is at 3pm tomorrow" → SAVE: "User has a meeting at 3pm tomorrow"
+User: "Explain how TCP works" → SKIP (general knowledge request)
+"""
+
+EXTRACTION_PROMPT_PREFIX = """Extract structured memory nodes from the conversation given at the end for a Neo4j graph.
+
+Allowed Node Labels: 'Preference', 'Fact', 'Entity', 'Constraint', 'Commitment', 'Instruction'.
+
+CRITICAL EXTRACTION RULES:
+1. ONLY extract information that is EXPLICITLY stated by the user or assistant or is a fact/indentifiable preference of the user.
+2. NEVER assume a user preference based on an assistant's choice of framework/tool in an example (e.g., if assistant uses 'actix-web', do NOT save it as a user preference unless the user specifically said "I like actix-web" or "Always use actix-web").
+3. IGNORE: simple examples, trivial requests ("give me hello world"), greetings, small talk.
+4. Each extraction must have a significance_score (1-10) based on long-term value.
+5. ONLY include nodes with significance_score >= 6.
+
+SPECIFIC NODE RULES:
+- Preference/Constraint/Instruction: ONLY save if the user EXPLICITLY requested it (e.g. "I prefer X", "Never do Y", "Always do Z").
+- Fact: Save objective information about the user mentioned in the turn.
+- Entity: Save people, places, or significant things mentioned.
+- Commitment: Save promises the ASSISTANT made to the user for the future.
+
+EXACT SCHEMAS FOR EACH NODE TYPE:
+
+Preference: { "id": "pref_xxx", "name": "preference_name", "value": "preference_value", "status": "active" }
+Fact: { "id": "fact_xxx", "statement": "complete factual statement", "status": "active" }
+Entity: { "id": "entity_xxx", "name": "entity_name", "type": "Person|Place|Thing|Concept", "status": "active", "context": "optional context" }
+Constraint: { "id": "const_xxx", "name": "constraint_name", "description": "detailed rule", "status": "active" }
+Commitment: { "id": "commit_xxx", "description": "what was promised", "due_date": "when|null", "status": "active" }
+Instruction: { "id": "instr_xxx", "description": "behavior instruction", "priority": "high|normal|low", "status": "active" }
+
+Instructions:
+1. Identify any new or updated information with lasting importance based ONLY on explicit statements.
+2. If a PREVIOUS fact is now false, use operation="DELETE" or status="obsolete".
+3. DO NOT extrapolate or guess user preferences.
+
+Output JSON:
+{
+    "significance_score": 1-10,
+    "should_save": boolean,
+    "nodes": [
+        {
+            "label": "Preference|Fact|Entity|Constraint|Commitment|Instruction",
+            "id": "unique_id_string", 
+            "properties": { ...use exact schema from above... },
+            "operation": "MERGE|DELETE|UPDATE" 
+        }
+    ],
+    "relationships": [
+        { "source_label": "...", "source_id": "...", "type": "...", "target_label": "...", "target_id": "..." }
+    ]
+}
+"""
+
+def build_planner_prompt(user_message, user_id, history_context, is_override, target_label):
+    return PLANNER_PROMPT_PREFIX + f'''
+Context:
+- User ID: '{user_id}'
+- Override Detected: {is_override}
+- Target: {target_label}
+
+Recent Conversation History:
+{history_context}
+
+User Message: "{user_message}"
+'''
+
+def _format_preference(node):
+    return f"  • {node.get('name', 'Unknown')}: {node.get('value', 'N/A')}"
+
+def _format_fact(node):
+    # Primary: 'statement' field
+    if 'statement' in node:
+        return f"  • {node['statement']}"
+    # Fallback: 'description' + 'value' fields
+    if 'description' in node:
+        desc = node['description']
+        val = node.get('value', '')
+        return f"  • {desc}: {val}" if val else f"  • {desc}"
+    # Last resort: show name or give up
+    return f"  • {node.get('name', str(node))}"
+
+def _format_entity(node):
+    name = node.get('name', 'Unknown')
+    entity_type = node.get('type', 'unknown type')
+    context = node.get('context', '')
+    if context:
+        return f"  • {name} ({entity_type}) - {context}"
+    return f"  • {name} ({entity_type})"
+
+def _format_constraint(node):
+    return f"  • {node.get('name', 'Unknown')}: {node.get('description', 'N/A')}"
+
+def _format_commitment(node):
+    description = node.get('description', 'N/A')
+    due_date = node.get('due_date', 'Not set')
+    if due_date and due_date != 'Not set':
+        return f"  • {description} [Due: {due_date}]"
+    return f"  • {description}"
+
+def _format_instruction(node):
+    return f"  • {node.get('description', 'N/A')} (priority: {node.get('priority', 'normal')})"
+
+_NODE_FORMATTERS = {
+    'Preferences': _format_preference,
+    'Facts': _format_fact,
+    'Entities': _format_entity,
+    'Constraints': _format_constraint,
+    'Commitments': _format_commitment,
+    'Instructions': _format_instruction,
+}
+
+def format_nodes(nodes, node_type):
+    """Format graph nodes of one type as bullet lines for the context block."""
+    if not nodes:
+        return f"  No {node_type} recorded."
+    return '\n'.join(map(_NODE_FORMATTERS[node_type], nodes))
+
 class Pipeline:
     def __init__(self, memory_manager: MemoryManager):
         self.memory_manager = memory_manager
         
         # Initialize LLM System
-        print("Initializing LLM System...")
+        log.info("Initializing LLM System...")
         
         force_local = os.getenv("FORCE_LOCAL", "false").lower() == "true"
         
         if force_local:
-            print("FORCE_LOCAL=true: Attempting to load Local LLM...")
+            log.info("FORCE_LOCAL=true: Attempting to load Local LLM...")
             try:
                 self.fast_llm = LLMFactory.get_provider("llama_local")
                 self.use_local_llm = True
-                print("✓ Local LLM (Llama) loaded successfully")
+                log.info("✓ Local LLM (Llama) loaded successfully")
             except (ImportError, Exception) as e:
-                print(f"⚠ Local LLM unavailable ({e}). Falling back to Groq.")
+                log.warning("⚠ Local LLM unavailable (%s). Falling back to Groq.", e)
                 self.fast_llm = LLMFactory.get_provider("groq")
                 self.use_local_llm = False
         else:
-            print("FORCE_LOCAL=false: Using Groq (Cloud Llama)...")
+            log.info("FORCE_LOCAL=false: Using Groq (Cloud Llama)...")
             self.fast_llm = LLMFactory.get_provider("groq")
             self.use_local_llm = False # distinct flag if logic depends on it, but here we just want the provider
         
@@ -39,66 +366,79 @@ class Pipeline:
         # BUT current pipeline uses `llm_to_use` which switches between local and remote.
         
         self.remote_llm = LLMFactory.get_provider("gemini")
-        print("✓ Remote LLM (Gemini) ready")
-        print("LLM System Ready.")
+        log.info("✓ Remote LLM (Gemini) ready")
+        
+        # Opt-in Step 4: distill context with the fast LLM before the final response.
+        # Off by default; the response model reads the reconciled context directly.
+        self.use_synthesis = os.getenv("USE_SYNTHESIS", "false").lower() == "true"
+        self.synthesis_min_context_chars = int(os.getenv("SYNTHESIS_MIN_CONTEXT_CHARS", "2048"))
+        
+        # Opt-in semantic response cache: a near-identical message from the same
+        # user returns the previous answer without running the pipeline. Entries
+        # are dropped whenever that user's graph memory is updated.
+        self.response_cache_enabled = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+        self.response_cache_max_distance = float(os.getenv("RESPONSE_CACHE_MAX_DISTANCE", "0.05"))
+        self.response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self._background_tasks = set()
+        self._update_queue = None
+        self._update_worker = None
+        log.info("LLM System Ready.")
 
-    def _deduplicate_results(self, results: list, threshold: float = 0.85) -> list:
+    def _deduplicate_results(self, results: list, embeddings: list, threshold: float = 0.95) -> tuple:
         """
-        Deduplicates semantic search results based on sequence similarity.
-        Keep results that are distinct enough (similarity < threshold).
+        Deduplicates semantic search results by embedding cosine similarity.
+        Keep results that are distinct enough (similarity < threshold); earlier results win.
         results: list of dicts {'id': ..., 'content': ...}
+        embeddings: vectors parallel to results (as returned by Chroma)
+        Returns (kept results, their embeddings).
         """
-        unique_results = []
-        for new_item in results:
-            is_duplicate = False
-            for existing_item in unique_results:
-                # Calculate similarity ratio
-                similarity = SequenceMatcher(None, new_item['content'], existing_item['content']).ratio()
-                if similarity > threshold:
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                unique_results.append(new_item)
+        if len(results) < 2:
+            return list(results), list(embeddings)
+        
+        E = np.asarray(embeddings, dtype=np.float32)
+        E /= np.maximum(np.linalg.norm(E, axis=1, keepdims=True), 1e-12)
+        S = E @ E.T  # all pairwise cosine similarities in one matmul
         
-        return unique_results
+        keep = _dedup_keep_mask(S, np.float32(threshold))
+        kept = np.flatnonzero(keep)
+        return [results[i] for i in kept], [embeddings[i] for i in kept]
 
     async def _save_message_to_db(self, conversation_id: str, role: str, content: str, metadata: dict = None):
         if not conversation_id:
             return
-        async with await get_db_connection() as conn:
+        async with get_db_connection() as conn:
             try:
                 await conn.execute('''
                     INSERT INTO messages (conversation_id, role, content, metadata)
                     VALUES ($1, $2, $3, $4)
-                ''', conversation_id, role, content, json.dumps(metadata) if metadata else None)
+                ''', conversation_id, role, content, orjson.dumps(metadata).decode() if metadata else None)
                 
                 # Update conversation updated_at
                 await conn.execute('''
                     UPDATE conversations SET updated_at = NOW() WHERE id = $1
                 ''', conversation_id)
             except Exception as e:
-                print(f"Failed to save message to DB: {e}")
+                log.error("Failed to save message to DB: %s", e)
 
     async def _generate_title_if_needed(self, conversation_id: str, user_message: str, assistant_response: str):
         if not conversation_id:
-            print("DEBUG: No conversation_id provided for title generation.")
+            log.debug("No conversation_id provided for title generation.")
             return
         
-        print(f"DEBUG: Checking title generation for {conversation_id}...")
-        async with await get_db_connection() as conn:
+        log.debug("Checking title generation for %s...", conversation_id)
+        async with get_db_connection() as conn:
             try:
                 # Check current title
                 row = await conn.fetchrow('SELECT title FROM conversations WHERE id = $1', conversation_id)
                 if not row:
-                    print(f"DEBUG: Conversation {conversation_id} not found.")
+                    log.debug("Conversation %s not found.", conversation_id)
                     return
                 
                 if row['title'] != "New Chat":
-                    print(f"DEBUG: Conversation already has title: '{row['title']}'. Skipping generation.")
+                    log.debug("Conversation already has title: '%s'. Skipping generation.", row['title'])
                     return
                 
-                print("DEBUG: Generating new title...")
+                log.debug("Generating new title...")
                 # Generate title using Groq
                 prompt = f"""
                 Generate a short, concise title (max 6 words) for this chat conversation based on the first exchange.
@@ -111,13 +451,85 @@ class Pipeline:
                 title = title.strip().strip('"')
                 
                 await conn.execute('UPDATE conversations SET title = $1 WHERE id = $2', title, conversation_id)
-                print(f"DEBUG: Updated conversation title to: {title}")
+                log.debug("Updated conversation title to: %s", title)
+            except Exception as e:
+                log.error("Failed to generate title: %s", e)
+
+    async def _cached_response(self, user_message: str, user_id: str):
+        """Semantic response cache lookup; returns a ChatResponse on a hit, else None."""
+        if not self.response_cache_enabled:
+            return None
+        try:
+            hit = await asyncio.to_thread(
+                self.memory_manager.lookup_cached_response,
+                user_id, user_message,
+                self.response_cache_max_distance, self.response_cache_ttl
+            )
+        except Exception as e:
+            log.warning("Response cache lookup failed (non-critical): %s", e)
+            return None
+        if not hit:
+            return None
+        log.debug("Response cache hit")
+        response = ChatResponse.model_validate_json(hit)
+        response.step_logs = {**(response.step_logs or {}), 'response_cache': 'hit'}
+        return response
+
+    def _cache_response(self, user_message: str, user_id: str, response: ChatResponse):
+        """Stores the response in the semantic cache without delaying the reply."""
+        if not self.response_cache_enabled:
+            return
+        
+        async def _store():
+            try:
+                await asyncio.to_thread(
+                    self.memory_manager.cache_response,
+                    user_id, user_message, response.model_dump_json()
+                )
             except Exception as e:
-                print(f"Failed to generate title: {e}")
+                log.warning("Response cache store failed (non-critical): %s", e)
+        
+        # Keep a reference so the task isn't garbage-collected mid-flight
+        task = asyncio.create_task(_store())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _generate_response(self, prompt: str, stream_to: asyncio.Queue = None) -> str:
+        """Final response generation; when stream_to is given, chunks are pushed to it as they arrive."""
+        if stream_to is None:
+            return await self.remote_llm.agenerate_text(prompt)
+        parts = []
+        async for chunk in self.remote_llm.astream_text(prompt):
+            parts.append(chunk)
+            await stream_to.put(chunk)
+        return "".join(parts)
 
-    async def process_turn(self, user_message: str, user_id: str, conversation_id: str = None) -> ChatResponse:
+    async def stream_turn(self, user_message: str, user_id: str, conversation_id: str = None):
+        """Runs process_turn, yielding ("token", text) while the response is generated
+        and finally ("done", ChatResponse)."""
+        queue = asyncio.Queue()
+        task = asyncio.create_task(self.process_turn(user_message, user_id, conversation_id, stream_to=queue))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (chunk := await queue.get()) is not None:
+                yield "token", chunk
+            yield "done", await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def process_turn(self, user_message: str, user_id: str, conversation_id: str = None, stream_to: asyncio.Queue = None) -> ChatResponse:
         if conversation_id:
             await self._save_message_to_db(conversation_id, "user", user_message)
+        
+        cached = await self._cached_response(user_message, user_id)
+        if cached:
+            if conversation_id:
+                await self._save_message_to_db(conversation_id, "assistant", cached.response, cached.step_logs)
+            if stream_to is not None:
+                await stream_to.put(cached.response)
+            return cached
+        
         logs = {}
         try:
             # Determine which LLM to use
@@ -125,11 +537,11 @@ class Pipeline:
             # If fast_llm failed to load (unlikely for Groq unless API key missing), fallback to remote.
             
             llm_to_use = self.fast_llm if self.fast_llm else self.remote_llm
-
+            
             # --- Step 0: Retrieve History if conversation_id exists ---
             history_context = ""
             if conversation_id:
-                async with await get_db_connection() as conn:
+                async with get_db_connection() as conn:
                     # Fetch last 10 messages (excluding the one we just saved)
                     rows = await conn.fetch('''
                         SELECT role, content 
@@ -148,141 +560,86 @@ class Pipeline:
                          history_context = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in messages])
             
             # --- Step 0.5: Temporal Context Planner ---
-            temporal_planner_prompt = f"""
-            Analyze the user message for any overrides or updates to previous preferences or schedules.
-            User Message: "{user_message}"
-            
-            Task:
-            1. Is the user correcting or updating something they might have said before? (e.g., "instead", "wait", "actually", "change to")
-            2. Identify the target entity type (User, Preference, Event).
-            
-            Output JSON:
-            {{
-                "is_override": boolean,
-                "target_node_label": "User|Preference|Event|null",
-                "conflict_summary": "string|null"
-            }}
-            """
-            temporal_check = await asyncio.to_thread(llm_to_use.generate_json, temporal_planner_prompt)
+            temporal_planner_prompt = TEMPORAL_PLANNER_PROMPT + f'''
+User Message: "{user_message}"
+'''
+
+            # --- Step 1: Planner (Intent Extraction) ---
+            # The planner is run speculatively (assuming no override) alongside
+            # the temporal check; it is only re-issued when an override is found
+            planner_prompt = build_planner_prompt(user_message, user_id, history_context, False, None)
+            temporal_check, planner_response = await asyncio.gather(
+                asyncio.to_thread(llm_to_use.generate_json, temporal_planner_prompt),
+                asyncio.to_thread(llm_to_use.generate_json, planner_prompt)
+            )
             logs['step0_temporal_check'] = temporal_check
             logs['step0_temporal_check']['model'] = llm_to_use.provider_name
             logs['step0_temporal_check']['prompt'] = temporal_planner_prompt
             if temporal_check.get('is_override'):
-                print(f"DEBUG: Temporal Conflict Detected: {temporal_check['conflict_summary']}")
+                log.debug("Temporal Conflict Detected: %s", temporal_check['conflict_summary'])
+                planner_prompt = build_planner_prompt(user_message, user_id, history_context, True, temporal_check.get('target_node_label'))
+                planner_response = await asyncio.to_thread(llm_to_use.generate_json, planner_prompt)
 
-            # --- Step 1: Planner (Intent Extraction) ---
-            planner_prompt = f"""
-            Analyze the following user message: "{user_message}"
-            Identify core entities and decide if external search is TRULY needed.
-            
-            Context:
-            - User ID: '{user_id}'
-            - Override Detected: {temporal_check.get('is_override')}
-            - Target: {temporal_check.get('target_node_label')}
-            
-            Recent Conversation History:
-            {history_context}
-            
-            Instructions:
-            1. **SEARCH POLICY**: 
-               - Set `needs_search` to `true` ONLY if the user asks for real-time data (weather, stocks, news and other stuff) or very specific recent events or for information through internet sources.
-               - Set `needs_search` to `false` for general knowledge (history, science, coding), opinions, or questions about the user's own data for which you are sure that the net LLM would have data in training.
-               - DO NOT search if the info might be in the long-term memory (Graph/Vector).
-            
-            2. **Graph/Vector Query**:
-               - Always generate `search_terms` for the vector DB (semantic memory).
-               - Always generate a `cypher_query` for the graph DB.
-               - Query for ACTIVE nodes only (status: 'active').
-            
-            Output JSON:
-            {{
-                "search_terms": ["term1", "term2"], 
-                "cypher_query": "MATCH ... RETURN ...", 
-                "needs_search": boolean,
-                "reasoning": "why search is needed or not"
-            }}
-            
-            Example Query: 
-            MATCH (u:User {{id: '{user_id}'}})
-            OPTIONAL MATCH (u)-[:HAS_PREFERENCE]->(p:Preference {{status: 'active'}})
-            OPTIONAL MATCH (u)-[:HAS_CONSTRAINT]->(c:Constraint {{status: 'active'}})
-            OPTIONAL MATCH (u)-[:HAS_FACT]->(f:Fact {{status: 'active'}})
-            RETURN p, c, f
-            """
-            
-            planner_response = await asyncio.to_thread(llm_to_use.generate_json, planner_prompt)
-            print(f"DEBUG: Raw Planner Response: {json.dumps(planner_response, indent=2)}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Raw Planner Response: %s", _pretty_json(planner_response))
             logs['step1_planner'] = planner_response
             logs['step1_planner']['model'] = llm_to_use.provider_name
             logs['step1_planner']['prompt'] = planner_prompt
             
             # --- Step 2: Retrieval ---
-            # Ensure User node exists first
-            self.memory_manager.ensure_user_exists(user_id)
+            # Graph Search (Neo4j) - ALWAYS retrieve ALL active nodes for the user
+            # This ensures turn 1 information is available at turn 1000
+            # Use comprehensive query to get ALL 6 node types
+            
+            # Vector search (ChromaDB, all terms in one batched query, in a worker
+            # thread), the graph query (async driver) and the User node MERGE
+            # all run concurrently
+            search_terms = planner_response.get('search_terms') or []
+            vector_task = asyncio.to_thread(self.memory_manager.search_vector_memory_batch, search_terms, n_results=5)
+            graph_task = self.memory_manager.run_graph_query(COMPREHENSIVE_USER_QUERY, {"user_id": user_id})
+            ensure_user_task = self.memory_manager.ensure_user_exists(user_id)
+            vector_outcome, graph_outcome, ensure_user_outcome = await asyncio.gather(
+                vector_task, graph_task, ensure_user_task, return_exceptions=True
+            )
+            if isinstance(ensure_user_outcome, Exception):
+                log.error("Failed to ensure user exists: %s", ensure_user_outcome)
+            
+            graph_results = []
+            if isinstance(graph_outcome, Exception):
+                log.error("Graph query failed: %s", graph_outcome)
+                logs['step2_graph_error'] = str(graph_outcome)
+            else:
+                graph_results = graph_outcome
+                log.debug("Graph Results: %s", graph_results)
             
-            # Vector Search (ChromaDB)
             vector_results = []
+            vector_embeddings = []
             seen_vector_ids = set()
             
-            if planner_response.get('search_terms'):
-                for term in planner_response['search_terms']:
-                    res = self.memory_manager.search_vector_memory(term, n_results=5)
-                    if res and res['documents'] and res['ids']:
-                        for i, list_of_docs in enumerate(res['documents']):
-                            list_of_ids = res['ids'][i]
-                            for j, doc in enumerate(list_of_docs):
-                                doc_id = list_of_ids[j]
-                                
-                                # 1. ID-based Deduplication
-                                if doc_id in seen_vector_ids:
-                                    continue
-                                    
-                                # 2. Content-based Deduplication (Fuzzy Match)
-                                is_duplicate = False
-                                for existing in vector_results:
-                                    existing_content = existing['content']
-                                    similarity = SequenceMatcher(None, doc, existing_content).ratio()
-                                    if similarity > 0.85: # 85% similarity threshold
-                                        is_duplicate = True
-                                        break
-                                
-                                if not is_duplicate:
-                                    vector_results.append({'id': doc_id, 'content': doc})
-                                    seen_vector_ids.add(doc_id)
+            if isinstance(vector_outcome, Exception):
+                raise vector_outcome
+            res = vector_outcome
+            if res and res['documents'] and res['ids']:
+                # One list of documents per search term
+                for i, list_of_docs in enumerate(res['documents']):
+                    list_of_ids = res['ids'][i]
+                    list_of_embeddings = res['embeddings'][i]
+                    for j, doc in enumerate(list_of_docs):
+                        doc_id = list_of_ids[j]
+                        
+                        # ID-based Deduplication (same turn hit by several terms)
+                        if doc_id in seen_vector_ids:
+                            continue
+                        vector_results.append({'id': doc_id, 'content': doc})
+                        vector_embeddings.append(list_of_embeddings[j])
+                        seen_vector_ids.add(doc_id)
             
-            # Fuzzy Deduplication (remove near-duplicates like similar code chunks)
-            vector_results = self._deduplicate_results(vector_results, threshold=0.85)
+            # Semantic Deduplication (remove near-duplicates like similar code chunks)
+            vector_results, vector_embeddings = self._deduplicate_results(vector_results, vector_embeddings)
             
             # Limit to top 10 unique results related to query
             vector_results = vector_results[:10]
-            
-            # Graph Search (Neo4j) - ALWAYS retrieve ALL active nodes for the user
-            # This ensures turn 1 information is available at turn 1000
-            graph_results = []
-            try:
-                # Use comprehensive query to get ALL 6 node types
-                comprehensive_query = f"""
-                MATCH (u:User {{id: '{user_id}'}})
-                OPTIONAL MATCH (u)-[:HAS_PREFERENCE]->(pref:Preference {{status: 'active'}})
-                OPTIONAL MATCH (u)-[:HAS_FACT]->(fact:Fact {{status: 'active'}})
-                OPTIONAL MATCH (u)-[:HAS_ENTITY]->(entity:Entity {{status: 'active'}})
-                OPTIONAL MATCH (u)-[:HAS_CONSTRAINT]->(constraint:Constraint {{status: 'active'}})
-                OPTIONAL MATCH (u)-[:HAS_COMMITMENT]->(commitment:Commitment {{status: 'active'}})
-                OPTIONAL MATCH (u)-[:HAS_INSTRUCTION]->(instruction:Instruction {{status: 'active'}})
-                RETURN 
-                    collect(DISTINCT pref) as preferences,
-                    collect(DISTINCT fact) as facts,
-                    collect(DISTINCT entity) as entities,
-                    collect(DISTINCT constraint) as constraints,
-                    collect(DISTINCT commitment) as commitments,
-                    collect(DISTINCT instruction) as instructions
-                """
-                print(f"DEBUG: Comprehensive Cypher Query: {comprehensive_query}")
-                graph_results = self.memory_manager.run_graph_query(comprehensive_query)
-                print(f"DEBUG: Graph Results: {graph_results}")
-            except Exception as e:
-                print(f"Graph query failed: {e}")
-                logs['step2_graph_error'] = str(e)
+            vector_embeddings = vector_embeddings[:10]
 
             logs['step2_retrieval'] = {
                 'vector': vector_results,
@@ -293,78 +650,21 @@ class Pipeline:
 
             # --- Step 3: Reasoning & De-confliction ---
             # Structure the graph results by node type (from comprehensive query)
+            result = graph_results[0] if graph_results else {}  # First row contains all collected nodes
+            # Filter out None values and ensure only active nodes
             structured_graph = {
-                'preferences': [],
-                'facts': [],
-                'entities': [],
-                'constraints': [],
-                'commitments': [],
-                'instructions': []
+                key: [
+                    node for node in result.get(key) or []
+                    if node and isinstance(node, dict) and node.get('status') != 'obsolete'
+                ]
+                for key in GRAPH_NODE_KEYS
             }
             
-            if graph_results and len(graph_results) > 0:
-                result = graph_results[0]  # First row contains all collected nodes
-                for key in structured_graph.keys():
-                    nodes = result.get(key, [])
-                    # Filter out None values and ensure only active nodes
-                    structured_graph[key] = [
-                        node for node in nodes 
-                        if node and isinstance(node, dict) and node.get('status') != 'obsolete'
-                    ]
-            
             # Build structured context for LLM
-            def format_nodes(nodes, node_type):
-                """Format nodes for display with all relevant fields."""
-                if not nodes:
-                    return f"  No {node_type} recorded."
-                formatted = []
-                for node in nodes:
-                    if node_type == 'Preferences':
-                        name = node.get('name', 'Unknown')
-                        value = node.get('value', 'N/A')
-                        formatted.append(f"  • {name}: {value}")
-                    
-                    elif node_type == 'Facts':
-                        # Primary: 'statement' field
-                        if 'statement' in node:
-                            formatted.append(f"  • {node['statement']}")
-                        # Fallback: 'description' + 'value' fields
-                        elif 'description' in node:
-                            desc = node['description']
-                            val = node.get('value', '')
-                            formatted.append(f"  • {desc}: {val}" if val else f"  • {desc}")
-                        # Last resort: show name or give up
-                        else:
-                            formatted.append(f"  • {node.get('name', str(node))}")
-                    
-                    elif node_type == 'Entities':
-                        name = node.get('name', 'Unknown')
-                        entity_type = node.get('type', 'unknown type')
-                        context = node.get('context', '')
-                        if context:
-                            formatted.append(f"  • {name} ({entity_type}) - {context}")
-                        else:
-                            formatted.append(f"  • {name} ({entity_type})")
-                    
-                    elif node_type == 'Constraints':
-                        name = node.get('name', 'Unknown')
-                        description = node.get('description', 'N/A')
-                        formatted.append(f"  • {name}: {description}")
-                    
-                    elif node_type == 'Commitments':
-                        description = node.get('description', 'N/A')
-                        due_date = node.get('due_date', 'Not set')
-                        if due_date and due_date != 'Not set':
-                            formatted.append(f"  • {description} [Due: {due_date}]")
-                        else:
-                            formatted.append(f"  • {description}")
-                    
-                    elif node_type == 'Instructions':
-                        description = node.get('description', 'N/A')
-                        priority = node.get('priority', 'normal')
-                
-                return '\n'.join(formatted)
-            
+            semantic_memory = (
+                "\n".join(f"  • {item['content']}" for item in vector_results)
+                if vector_results else "  No recent semantic context."
+            )
             context_str = f"""
 === USER LONG-TERM MEMORY (Graph Database) ===
 This information persists across ALL conversations and MUST influence your responses.
@@ -388,37 +688,28 @@ This information persists across ALL conversations and MUST influence your respo
 {format_nodes(structured_graph['instructions'], 'Instructions')}
 
 === SEMANTIC MEMORY (Recent Context) ===
-=== SEMANTIC MEMORY (Recent Context) ===
-{chr(10).join([f'  • {item["content"]}' for item in vector_results]) if vector_results else '  No recent semantic context.'}
+{semantic_memory}
             """
             logs['step3_reconciliation'] = {
                 "content": context_str,
                 "model": "Rules Based (Python)"
             }
 
-            if self.fast_llm:
+            semantic_context = "\n".join(f"- {item['content']}" for item in vector_results)
+
+            # Distilling only pays for its extra round-trip on large contexts
+            if self.use_synthesis and self.fast_llm and len(context_str) >= self.synthesis_min_context_chars:
                 # --- Step 4: Synthesis (Context Distillation) ---
                 # Goal: Produce a SHORT context brief, NOT a full response
-                synthesis_prompt = f"""
-                You are a Context Distiller. Your ONLY job is to output a short bullet-point summary of relevant context for another AI to use when responding.
-                
-                User Message: "{user_message}"
-                
-                Memory Snapshot:
-                {context_str}
+                synthesis_prompt = SYNTHESIS_PROMPT_PREFIX + f'''
+Memory Snapshot:
+{context_str}
 
-                Recent Conversation History (Short Term Memory):
-                {history_context}
-                
-                OUTPUT RULES:
-                - Output ONLY a short bullet-point list of facts relevant to the user's current message and relevant preferences,facts.
-                - DO NOT answer the user's question yourself
-                - DO NOT generate code, explanations, or any response content
-                - DO NOT analyze or reason about the context
-                - Keep it under 5 bullet points
-                - If no memory is relevant, just say "No relevant context."
-                
-"""
+Recent Conversation History (Short Term Memory):
+{history_context}
+
+User Message: "{user_message}"
+'''
 
                 synthesis_response = await asyncio.to_thread(self.fast_llm.generate_text, synthesis_prompt)
                 logs['step4_synthesis'] = {
@@ -426,102 +717,69 @@ This information persists across ALL conversations and MUST influence your respo
                     "model": self.fast_llm.provider_name,
                     "prompt": synthesis_prompt
                 }
-                response_input = synthesis_response
-            else:
-                # Optimized Remote Path
-                print("DEBUG: Optimizing - Reasoning directly in final response...")
-                response_input = None
-                
-                # Directly append vector results to the response prompt context
-                semantic_context = "\n".join([f"- {item['content']}" for item in vector_results])
-                
-                response_prompt = f"""
-                You are a helpful AI assistant with long-term memory.
-                
-                User Message: "{user_message}"
-                
-                Your Memory of This User:
-                {context_str}
+                context_used = synthesis_response
 
-                Recent Conversation History:
-                {history_context}
-                
-                Relevant Semantic Context (Past Conversations):
-                {semantic_context if vector_results else "No relevant past conversations found."}
-                
-                Instructions:
-                - Respond naturally and helpfully to the user's message
-                - Use your memory to personalize your response (e.g. if they prefer Rust, give code in Rust)
-                - If the user is updating a fact, acknowledge the update
-                - NEVER mention "memory", "context", "graph database", or internal systems to the user
-                - Respond as if you naturally remember these things about them
-                """
-                
-                final_response = await asyncio.to_thread(self.remote_llm.generate_text, response_prompt)
-                synthesis_response = "Direct response path (no separate synthesis)."
+                response_prompt = RESPONSE_PROMPT_PREFIX + f'''
+What you remember about this user:
+{synthesis_response}
+
+Recent Conversation History:
+{history_context}
+
+User Message: "{user_message}"
+'''
+            else:
+                # Fused path: the response model reads the reconciled context
+                # directly, saving a full fast-LLM decode on the critical path
                 logs['step4_synthesis'] = {
-                    "content": synthesis_response,
+                    "content": "Direct response path (no separate synthesis).",
                     "model": self.remote_llm.provider_name,
                     "prompt": "Direct Response Prompt"
                 }
-                logs['step5_response'] = {
-                    "prompt": response_prompt,
-                    "model": self.remote_llm.provider_name
-                }
+                context_used = context_str
 
+                response_prompt = DIRECT_RESPONSE_PROMPT_PREFIX + f'''
+Your Memory of This User:
+{context_str}
 
-            if response_input:
-                response_prompt = f"""
-                You are a helpful AI assistant with long-term memory. You remember things about the user from previous conversations.
-                
-                User Message: "{user_message}"
-                
-                What you remember about this user:
-                {response_input}
+Recent Conversation History:
+{history_context}
 
-                Recent Conversation History:
-                {history_context}
-                
-                Instructions:
-                - Respond directly and helpfully to the user's message
-                - Use what you remember to personalize your response (e.g. if they prefer Rust, write code in Rust without being asked)
-                - Do NOT explain your reasoning or analysis process
-                - Do NOT mention "memory", "context", "database" or internal systems
-                - Respond as if you naturally remember these things
-                - Be concise and directly address what the user asked for
-                """
-                
-                logs['step5_response'] = {
-                    "prompt": response_prompt,
-                    "model": self.remote_llm.provider_name
-                }
-                
-                # Check if search is needed
-                tools_config = None
-                if planner_response.get('needs_search'):
-                    print("DEBUG: Search tool requested by planner.")
-                    tools_config = {'google_search': {}}
+Relevant Semantic Context (Past Conversations):
+{semantic_context if vector_results else "No relevant past conversations found."}
+
+User Message: "{user_message}"
+'''
+
+            logs['step5_response'] = {
+                "prompt": response_prompt,
+                "model": self.remote_llm.provider_name
+            }
+            
+            # Check if search is needed
+            if planner_response.get('needs_search'):
+                log.debug("Search tool requested by planner.")
+                tools_config = {'google_search': {}}
+            
+                # If searching, we want the grounding metadata
+                gen_result = await self.remote_llm.agenerate_text(
+                    response_prompt, 
+                    tools=tools_config,
+                    return_full_response=True
+                )
                 
-                    # If searching, we want the grounding metadata
-                    gen_result = await asyncio.to_thread(
-                        self.remote_llm.generate_text, 
-                        response_prompt, 
-                        tools=tools_config,
-                        return_full_response=True
-                    )
-                    
-                    if isinstance(gen_result, dict):
-                        final_response = gen_result['text']
-                        grounding_metadata = gen_result.get('grounding_metadata')
-                    else:
-                        final_response = gen_result # Should be string if fallback
-                        grounding_metadata = None
+                if isinstance(gen_result, dict):
+                    final_response = gen_result['text']
+                    grounding_metadata = gen_result.get('grounding_metadata')
                 else:
+                    final_response = gen_result # Should be string if fallback
                     grounding_metadata = None
-                    final_response = await asyncio.to_thread(
-                        self.remote_llm.generate_text, 
-                        response_prompt
-                    )
+                # Grounded answers are not streamed; emit them in one piece
+                if stream_to is not None:
+                    await stream_to.put(final_response)
+            else:
+                grounding_metadata = None
+                final_response = await self._generate_response(response_prompt, stream_to)
             
             # Save Assistant Message
             if conversation_id:
@@ -530,298 +788,276 @@ This information persists across ALL conversations and MUST influence your respo
                     logs['grounding_metadata'] = grounding_metadata
                 await self._save_message_to_db(conversation_id, "assistant", final_response, logs)
 
-            return ChatResponse(
+            response = ChatResponse(
                 response=final_response,
-                context_used=synthesis_response,
+                context_used=context_used,
                 step_logs=logs,
                 grounding_metadata=grounding_metadata
             )
+            response._retrieved_embeddings = vector_embeddings
+            # Search-grounded answers are time-sensitive and error replies are
+            # transient; don't cache either
+            if not grounding_metadata and not ERROR_SIGNATURE_RE.search(final_response):
+                self._cache_response(user_message, user_id, response)
+            return response
         except Exception as e:
-            print(f"Pipeline Error: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Pipeline Error: %s", e)
             return ChatResponse(
                 response="I'm currently experiencing system issues. Please try again in a moment.",
                 context_used="Error during processing.",
                 step_logs={"error": str(e), "partial_logs": logs}
             )
 
-    async def run_async_update(self, user_message: str, assistant_response: str, user_id: str, retrieved_context: dict = None, conversation_id: str = None):
+    def start_update_worker(self):
+        """Starts the Step 6 worker; must be called from the running event loop."""
+        if self._update_worker is None:
+            self._update_queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+            self._update_worker = asyncio.create_task(self._run_update_worker())
+
+    async def stop_update_worker(self):
+        """Gives queued updates a chance to finish, then stops the worker."""
+        if self._update_worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._update_queue.join(), UPDATE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Dropping %d queued memory update(s) on shutdown", self._update_queue.qsize())
+        self._update_worker.cancel()
+        self._update_worker = None
+
+    def enqueue_update(self, user_message: str, assistant_response: str, user_id: str, *args, **kwargs):
+        """Queues a Step 6 update (same arguments as run_async_update) without waiting on it."""
+        if self._update_worker is None:
+            self.start_update_worker()
+        try:
+            self._update_queue.put_nowait((user_id, (user_message, assistant_response, user_id, *args), kwargs))
+        except asyncio.QueueFull:
+            log.warning("Memory update queue full, skipping update for user %s", user_id)
+
+    async def _run_update_worker(self):
+        while True:
+            batch = [await self._update_queue.get()]
+            while len(batch) < UPDATE_WORKER_BATCH and not self._update_queue.empty():
+                batch.append(self._update_queue.get_nowait())
+            
+            # One user's turns are applied in order so later dedup sees earlier
+            # writes; different users' updates run concurrently
+            by_user = defaultdict(list)
+            for user_id, args, kwargs in batch:
+                by_user[user_id].append((args, kwargs))
+            
+            async def _apply(items):
+                for args, kwargs in items:
+                    try:
+                        await self.run_async_update(*args, **kwargs)
+                    except Exception as e:
+                        # Keep applying this user's later turns
+                        log.exception("Memory update failed: %s", e)
+            
+            await asyncio.gather(*(_apply(items) for items in by_user.values()))
+            for _ in batch:
+                self._update_queue.task_done()
+
+    async def run_async_update(self, user_message: str, assistant_response: str, user_id: str, retrieved_context: dict = None, conversation_id: str = None, retrieved_embeddings: list = None):
         """Step 6 implementation: Embed turn and update Neo4j using Local LLM."""
-        print("Running async update...")
+        log.info("Running async update...")
         
         # Title generation is now handled inline in the /chat endpoint
 
         # Prevent memory pollution from error messages
-        error_signatures = [
-            "Thinking process interrupted",
-            "I'm currently experiencing system issues.",
-            "Error during processing.",
-            "System limited"
-        ]
-        if any(err in assistant_response for err in error_signatures):
-            print("Skipping async update due to error response.")
+        if ERROR_SIGNATURE_RE.search(assistant_response):
+            log.info("Skipping async update due to error response.")
+            return
+        
+        if TRIVIAL_TURN_RE.fullmatch(user_message):
+            log.info("⊘ Skipped async update (trivial turn)")
             return
         
         llm_to_use = self.context_llm
 
         # --- Sub-step 6a: Semantic Filter (Vector DB Hygiene) ---
-        semantic_filter_prompt = f"""
-        You are a Memory Filter in a long-term memory system for an AI assistant.
-        Your job is to decide if this conversation turn contains USER-SPECIFIC information worth remembering across future conversations.
-        
-        User: "{user_message}"
-        Assistant: "{assistant_response}"
-        
-        SAVE ONLY user-specific information such as:
-        - Personal preferences ("I prefer Rust", "I'm vegetarian")
-        - Facts about the user ("My name is Adi", "I work at Google", "My best friend is Tobey")
-        - Constraints they set ("Never use emojis", "Keep responses short")
-        - Long-term instructions ("Always explain with analogies")
-        - Important personal context ("I'm preparing for an interview next week")
-        
-        DO NOT SAVE:
-        - General knowledge the AI generated (code examples, explanations, tutorials)
-        - The content of what the assistant produced (a web server program, a poem, etc.)
-        - Information that any AI would already know (how Rust works, what actix-web is)
-        - Simple task completions ("User asked for X, assistant provided X")
-        
-        Output JSON:
-        - meaningful_content: (boolean) true ONLY if there is user-specific info to remember
-        - summary: (string) a short summary of the USER-SPECIFIC info only, or null
-        - reasoning: (string) why this is or isn't user-specific
-        
-        Examples:
-        User: "I prefer Rust" → SAVE: "User prefers Rust for coding examples"
-        User: "Write me a web server" → SKIP (general task, nothing personal to remember)
-        User: "My meeting is at 3pm tomorrow" → SAVE: "User has a meeting at 3pm tomorrow"
-        User: "Explain how TCP works" → SKIP (general knowledge request)
-        """
+        semantic_filter_prompt = SEMANTIC_FILTER_PROMPT_PREFIX + f'''
+User: "{user_message}"
+Assistant: "{assistant_response}"
+'''
         try:
             semantic_analysis = await asyncio.to_thread(llm_to_use.generate_json, semantic_filter_prompt)
-            print(f"DEBUG: Semantic Analysis: {json.dumps(semantic_analysis, indent=2)}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Semantic Analysis: %s", _pretty_json(semantic_analysis))
             
             if semantic_analysis.get('meaningful_content') and semantic_analysis.get('summary'):
                 # Save ONLY the clean summary - no original turn needed
                 summary = semantic_analysis['summary']
                 
                 should_save = True
+                summary_embedding = None
                 
                 # Check against retrieved context to avoid duplication
-                if retrieved_context and retrieved_context.get('vector'):
-                    for item in retrieved_context['vector']:
-                        # Check for exact or near match in what we JUST retrieved
-                        # This saves a DB call if we already know this info
-                        if summary.strip() == item['content'].strip():
-                             print(f"⊘ Skipped Vector DB (Already in retrieved context: '{summary[:50]}...')")
-                             should_save = False
-                             break
+                # (exact text match on what we JUST retrieved - no DB call)
+                if retrieved_context and any(
+                    summary.strip() == item['content'].strip()
+                    for item in retrieved_context.get('vector') or []
+                ):
+                    log.info("⊘ Skipped Vector DB (Already in retrieved context: '%s...')", summary[:50])
+                    should_save = False
                 
                 if should_save:
-                    # Deduplication check: search for similar content before saving (Double check)
-                    import time
-                    existing_results = self.memory_manager.search_vector_memory(summary, n_results=1)
+                    # Embed once; reused for the in-memory check, the store query and the insert
+                    summary_embedding = (await asyncio.to_thread(self.memory_manager.embed, [summary]))[0]
+                    
+                    # Near match against the retrieved embeddings (in-process cosine, no DB call)
+                    if retrieved_embeddings:
+                        E = np.asarray(retrieved_embeddings, dtype=np.float32)
+                        q = np.asarray(summary_embedding, dtype=np.float32)
+                        sims = (E @ q) / np.maximum(np.linalg.norm(E, axis=1) * np.linalg.norm(q), 1e-12)
+                        if sims.max() > VECTOR_DUPLICATE_COSINE:
+                            log.info("⊘ Skipped Vector DB (Similar to retrieved context, cosine: %.4f)", sims.max())
+                            should_save = False
                 
-                # Check if we already have very similar content
-                should_save = True
-                if existing_results and existing_results.get('documents') and existing_results['documents'][0]:
-                    existing_doc = existing_results['documents'][0][0]
+                if should_save:
+                    # Deduplication check: search the whole store before saving (Double check)
+                    existing_results = await asyncio.to_thread(
+                        self.memory_manager.search_vector_memory, summary, 1, summary_embedding
+                    )
                     
-                    # Method 1: Exact text match
-                    if existing_doc.strip() == summary.strip():
-                        print(f"⊘ Skipped Vector DB (Exact duplicate: '{summary[:50]}...')")
-                        should_save = False
-                    # Method 2: Distance-based similarity (ChromaDB uses L2 by default)
-                    elif existing_results.get('distances') and existing_results['distances'][0]:
-                        top_distance = existing_results['distances'][0][0]
-                        print(f"DEBUG: ChromaDB distance for '{summary[:40]}...': {top_distance} (existing: '{existing_doc[:40]}...')")
-                        if top_distance < 0.5:  # L2 distance threshold
-                            print(f"⊘ Skipped Vector DB (Similar content, distance: {top_distance:.4f})")
+                    # Check if we already have very similar content
+                    if existing_results and existing_results.get('documents') and existing_results['documents'][0]:
+                        existing_doc = existing_results['documents'][0][0]
+                        
+                        # Method 1: Exact text match
+                        if existing_doc.strip() == summary.strip():
+                            log.info("⊘ Skipped Vector DB (Exact duplicate: '%s...')", summary[:50])
                             should_save = False
+                        # Method 2: Distance-based similarity (ChromaDB uses L2 by default)
+                        elif existing_results.get('distances') and existing_results['distances'][0]:
+                            top_distance = existing_results['distances'][0][0]
+                            log.debug("ChromaDB distance for '%s...': %s (existing: '%s...')", summary[:40], top_distance, existing_doc[:40])
+                            if top_distance < 0.5:  # L2 distance threshold
+                                log.info("⊘ Skipped Vector DB (Similar content, distance: %.4f)", top_distance)
+                                should_save = False
                 
                 if should_save:
                     turn_id = f"turn_{user_id}_{int(time.time()*1000)}"
-                    self.memory_manager.add_vector_memory(
+                    await asyncio.to_thread(
+                        self.memory_manager.add_vector_memory,
                         turn_id, 
                         summary,  # Save ONLY the summary
-                        metadata={
+                        {
                             "user_id": user_id, 
                             "timestamp": time.time(), 
                             "type": "semantic_memory"
-                        }
+                        },
+                        summary_embedding
                     )
-                    print(f"✓ Saved to Vector DB: '{summary[:50]}...'")
+                    log.info("✓ Saved to Vector DB: '%s...'", summary[:50])
             else:
-                print("⊘ Skipped Vector DB (No long-term value)")
+                log.info("⊘ Skipped Vector DB (No long-term value)")
         except Exception as e:
-            print(f"Semantic filter failed: {e}. Skipping save to avoid pollution.")
+            log.error("Semantic filter failed: %s. Skipping save to avoid pollution.", e)
             # Changed: Do NOT save on failure to avoid polluting the DB
 
         # --- Sub-step 6b: Enhanced Graph Extraction with Strength Filter ---
-        extraction_prompt = f"""
-        Extract structured memory nodes from this conversation for a Neo4j graph.
-        User: "{user_message}"
-        Assistant: "{assistant_response}"
-        User: "{user_message}"
-        Assistant: "{assistant_response}"
-        User ID: "{user_id}"
-
-        EXISTING KNOWLEDGE (Do NOT re-extract these unless updating/correcting):
-        {retrieved_context['graph'] if retrieved_context and retrieved_context.get('graph') else "No existing graph context retrieved."}
-        
-        Allowed Node Labels: 'Preference', 'Fact', 'Entity', 'Constraint', 'Commitment', 'Instruction'.
-        
-        CRITICAL EXTRACTION RULES:
-        1. ONLY extract information that is EXPLICITLY stated by the user or assistant or is a fact/indentifiable preference of the user.
-        2. NEVER assume a user preference based on an assistant's choice of framework/tool in an example (e.g., if assistant uses 'actix-web', do NOT save it as a user preference unless the user specifically said "I like actix-web" or "Always use actix-web").
-        3. IGNORE: simple examples, trivial requests ("give me hello world"), greetings, small talk.
-        4. Each extraction must have a significance_score (1-10) based on long-term value.
-        5. ONLY include nodes with significance_score >= 6.
-        
-        SPECIFIC NODE RULES:
-        - Preference/Constraint/Instruction: ONLY save if the user EXPLICITLY requested it (e.g. "I prefer X", "Never do Y", "Always do Z").
-        - Fact: Save objective information about the user mentioned in the turn.
-        - Entity: Save people, places, or significant things mentioned.
-        - Commitment: Save promises the ASSISTANT made to the user for the future.
-        
-        EXACT SCHEMAS FOR EACH NODE TYPE:
-        
-        Preference: {{ "id": "pref_xxx", "name": "preference_name", "value": "preference_value", "status": "active" }}
-        Fact: {{ "id": "fact_xxx", "statement": "complete factual statement", "status": "active" }}
-        Entity: {{ "id": "entity_xxx", "name": "entity_name", "type": "Person|Place|Thing|Concept", "status": "active", "context": "optional context" }}
-        Constraint: {{ "id": "const_xxx", "name": "constraint_name", "description": "detailed rule", "status": "active" }}
-        Commitment: {{ "id": "commit_xxx", "description": "what was promised", "due_date": "when|null", "status": "active" }}
-        Instruction: {{ "id": "instr_xxx", "description": "behavior instruction", "priority": "high|normal|low", "status": "active" }}
-        
-        Instructions:
-        1. Identify any new or updated information with lasting importance based ONLY on explicit statements.
-        2. If a PREVIOUS fact is now false, use operation="DELETE" or status="obsolete".
-        3. DO NOT extrapolate or guess user preferences.
-        
-        Output JSON:
-        {{
-            "significance_score": 1-10,
-            "should_save": boolean,
-            "nodes": [
-                {{
-                    "label": "Preference|Fact|Entity|Constraint|Commitment|Instruction",
-                    "id": "unique_id_string", 
-                    "properties": {{ ...use exact schema from above... }},
-                    "operation": "MERGE|DELETE|UPDATE" 
-                }}
-            ],
-            "relationships": [
-                {{ "source_label": "...", "source_id": "...", "type": "...", "target_label": "...", "target_id": "..." }}
-            ]
-        }}
-        """
+        extraction_prompt = EXTRACTION_PROMPT_PREFIX + f'''
+EXISTING KNOWLEDGE (Do NOT re-extract these unless updating/correcting):
+{retrieved_context['graph'] if retrieved_context and retrieved_context.get('graph') else "No existing graph context retrieved."}
+
+User ID: "{user_id}"
+User: "{user_message}"
+Assistant: "{assistant_response}"
+'''
         
         try:
-            updates = await asyncio.to_thread(llm_to_use.generate_json, extraction_prompt)
-            print(f"DEBUG: Async Update JSON: {json.dumps(updates, indent=2)}")
+            # Nodes plus relationships outgrow the planner-sized JSON cap
+            updates = await asyncio.to_thread(llm_to_use.generate_json, extraction_prompt, max_tokens=512)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Async Update JSON: %s", _pretty_json(updates))
             
             # Check significance score before saving
             significance = updates.get('significance_score', 0)
             should_save = updates.get('should_save', False)
             
             if significance < 6 or not should_save:
-                print(f"⊘ Skipped Graph Update (Low significance: {significance}/10)")
+                log.info("⊘ Skipped Graph Update (Low significance: %s/10)", significance)
                 return
             
-            print(f"✓ Graph Update Approved (Significance: {significance}/10)")
+            log.info("✓ Graph Update Approved (Significance: %s/10)", significance)
             
-            if updates.get('nodes'):
-                for node in updates['nodes']:
-                    label = node['label']
-                    props = node.get('properties', {}).copy()
-                    op = node.get('operation', 'MERGE').upper()
-                    
-                    if 'id' in node:
-                        props['id'] = node['id']
-                    
-                    # Handle Deletions/Updates
-                    if op == 'DELETE' or props.get('status') == 'obsolete':
-                         # If we have an ID, mark it as obsolete directly
-                         if 'id' in props:
-                            # We can use supersede to self (hack) or just run a query
-                            # For now, let's use a custom query to "delete"/archive
-                            archive_query = f"MATCH (n:{label} {{id: $id}}) SET n.status = 'obsolete', n.archived_at = timestamp() RETURN n"
-                            self.memory_manager.run_graph_query(archive_query, {"id": props['id']})
-                            print(f"DEBUG: Archived node {props['id']}")
-                         continue
-
-                    # --- Memory Gardener: Dedup ALL node types ---
-                    existing = []
-                    
-                    if label == 'Fact':
-                        # Check by statement text
-                        stmt = props.get('statement', '')
-                        if stmt:
-                            check_query = f"""
-                            MATCH (u:User {{id: $uid}})-[:HAS_FACT]->(n:Fact {{status: 'active'}})
-                            WHERE n.statement = $stmt
-                            RETURN n.id as id
-                            """
-                            existing = self.memory_manager.run_graph_query(check_query, {"uid": user_id, "stmt": stmt})
-                            if existing:
-                                print(f"⊘ Skipped duplicate Fact: '{stmt[:50]}'")
-                                continue
-                    
-                    elif label == 'Entity':
-                        # Check by name
-                        name = props.get('name', '')
-                        if name:
-                            check_query = f"""
-                            MATCH (u:User {{id: $uid}})-[:HAS_ENTITY]->(n:Entity {{name: $name, status: 'active'}})
-                            RETURN n.id as id
-                            """
-                            existing = self.memory_manager.run_graph_query(check_query, {"uid": user_id, "name": name})
-                            if existing:
-                                # Update existing entity instead of creating duplicate
-                                old_id = existing[0]['id']
-                                print(f"⊘ Entity '{name}' already exists (id: {old_id}), updating props")
-                                update_query = f"MATCH (n:Entity {{id: $id}}) SET n += $props RETURN n"
-                                self.memory_manager.run_graph_query(update_query, {"id": old_id, "props": props})
-                                continue
-                    
-                    elif label in ['Preference', 'Constraint', 'Instruction', 'Commitment'] and 'name' in props:
-                        # Check by name for named node types
-                        check_query = f"""
-                        MATCH (u:User {{id: $uid}})-[:HAS_{label.upper()}]->(n:{label} {{name: $name, status: 'active'}})
-                        RETURN n.id as id
-                        """
-                        existing = self.memory_manager.run_graph_query(check_query, {"uid": user_id, "name": props['name']})
+            # Cached answers may rely on memory that is about to change
+            if self.response_cache_enabled:
+                await asyncio.to_thread(self.memory_manager.invalidate_cached_responses, user_id)
+            
+            # One Neo4j session (pooled connection) for all graph work of this turn.
+            # Nodes are grouped by label first, so archiving, dedup lookups and
+            # writes each cost one UNWIND query per label instead of one per node.
+            archive_by_label = defaultdict(list)
+            candidates_by_label = defaultdict(list)
+            seen_keys = set()
+            for node in updates.get('nodes') or []:
+                label = node['label']
+                props = node.get('properties', {}).copy()
+                op = node.get('operation', 'MERGE').upper()
+                
+                if 'id' in node:
+                    props['id'] = node['id']
+                
+                # Handle Deletions/Updates
+                if op == 'DELETE' or props.get('status') == 'obsolete':
+                    # If we have an ID, mark it as obsolete directly
+                    if 'id' in props:
+                        archive_by_label[label].append(props['id'])
+                    continue
+                
+                # Writes are deferred, so also dedup within this batch
+                key = props.get(GRAPH_DEDUP_KEYS.get(label, ''))
+                if key and (label, key) in seen_keys:
+                    log.info("⊘ Skipped duplicate %s in batch: '%s'", label, str(key)[:50])
+                    continue
+                seen_keys.add((label, key))
+                candidates_by_label[label].append((key, props))
+            
+            rels_by_shape = defaultdict(list)
+            async with self.memory_manager.graph_session() as session:
+                for label, ids in archive_by_label.items():
+                    archive_query = f"UNWIND $ids AS id MATCH (n:{label} {{id: id}}) SET n.status = 'obsolete', n.archived_at = timestamp()"
+                    await self.memory_manager.run_graph_query(archive_query, {"ids": ids}, session=session)
+                    log.debug("Archived %d %s node(s)", len(ids), label)
+                
+                # --- Memory Gardener: Dedup ALL node types ---
+                for label, candidates in candidates_by_label.items():
+                    key_field = GRAPH_DEDUP_KEYS.get(label)
                     
-                    # Add new node
-                    self.memory_manager.add_graph_node(label, props)
+                    if label in ('Fact', 'Entity'):
+                        # Idempotent MERGE on the natural key: duplicate Facts are
+                        # left alone, existing Entities get the new props
+                        existed = await self.memory_manager.merge_user_nodes(
+                            user_id, label, key_field, [props for _, props in candidates],
+                            update_on_match=(label == 'Entity'), session=session
+                        )
+                        for key in existed:
+                            log.info("⊘ %s '%s' already exists, merged", label, str(key)[:50])
+                        # Keyless nodes fall through to a plain insert
+                        candidates = [(key, props) for key, props in candidates if not key]
                     
-                    # Connect to User node
-                    self.memory_manager.create_relationship(
-                        'User', user_id,
-                        f'HAS_{label.upper()}',
-                        label, props['id']
+                    # Insert, link to the User and supersede the user's older
+                    # active version (Preference/Constraint/etc) in one query
+                    superseded = await self.memory_manager.add_user_nodes(
+                        user_id, label, [props for _, props in candidates],
+                        supersede_key=key_field, session=session
                     )
-                    
-                    # Apply SUPERSEDES if older version found (for Preference/Constraint/etc)
-                    if existing:
-                        old_id = existing[0]['id']
-                        if old_id != props.get('id'):
-                            self.memory_manager.supersede_node(old_id, props.get('id'), label)
-            
-            if updates.get('relationships'):
-                for rel in updates['relationships']:
-                    self.memory_manager.create_relationship(
-                        rel['source_label'], rel['source_id'],
-                        rel['type'],
-                        rel['target_label'], rel['target_id'],
-                        rel.get('properties', {})
+                    for key in superseded:
+                        log.info("↻ %s '%s' superseded by newer version", label, str(key)[:50])
+                
+                for rel in updates.get('relationships') or []:
+                    rels_by_shape[(rel['source_label'], rel['type'], rel['target_label'])].append(
+                        {"s": rel['source_id'], "t": rel['target_id'], "props": rel.get('properties') or {}}
                     )
-            print("Memory Gardener: Graph updated and de-conflicted.")
+                
+                for (src_label, rel_type, tgt_label), rows in rels_by_shape.items():
+                    await self.memory_manager.create_relationships(src_label, rel_type, tgt_label, rows, session=session)
+            log.info("Memory Gardener: Graph updated and de-conflicted.")
         except Exception as e:
-            print(f"Async update failed: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Async update failed: %s", e)
 
-    @property
+    @cached_property
     def context_llm(self) -> LLMProvider:
         return LLMFactory.get_provider("groq")
@@ -6,43 +6,64 @@ Run this once to clean existing data, then the dedup logic in pipeline.py preven
 
 import chromadb
 from dotenv import load_dotenv
+from backend.memory_manager import enable_chroma_wal
+import hashlib
 import os
 
 load_dotenv()
 
+GET_PAGE_SIZE = 5000
+WRITE_CHUNK_SIZE = 10000
+
 def clean_chroma_db():
     print("🧹 Cleaning ChromaDB duplicates...")
     
+    enable_chroma_wal("./chroma_db")
     client = chromadb.PersistentClient(path="./chroma_db")
     collection = client.get_or_create_collection(name="conversation_memory")
     
-    all_data = collection.get(include=["documents", "metadatas"])
+    # Page through the collection, remembering only a 16-byte digest of each
+    # normalized document — keep first occurrence, delete rest. Rows written
+    # before content_sha existed get it backfilled, so the backend's insert-time
+    # dedup filter covers them too.
+    seen_digests = set()
+    ids_to_delete = []
+    backfill_ids, backfill_metadatas = [], []
+    total = 0
+    offset = 0
+    while True:
+        batch = collection.get(limit=GET_PAGE_SIZE, offset=offset, include=["documents", "metadatas"])
+        if not batch['ids']:
+            break
+        offset += len(batch['ids'])
+        for doc_id, doc, meta in zip(batch['ids'], batch['documents'], batch['metadatas']):
+            digest = hashlib.blake2b((doc or "").strip().lower().encode(), digest_size=16).digest()
+            if digest in seen_digests:
+                ids_to_delete.append(doc_id)
+                continue
+            seen_digests.add(digest)
+            if not (meta or {}).get("content_sha"):
+                backfill_ids.append(doc_id)
+                backfill_metadatas.append({**(meta or {}), "content_sha": digest.hex()})
+        total = offset
     
-    if not all_data or not all_data.get('documents'):
+    if not total:
         print("  ChromaDB is empty.")
         return
-    
-    total = len(all_data['documents'])
     print(f"  Found {total} total entries.")
     
-    # Track unique content — keep first occurrence, delete rest
-    seen_content = {}
-    ids_to_delete = []
-    
-    for i, doc in enumerate(all_data['documents']):
-        doc_id = all_data['ids'][i]
-        normalized = doc.strip().lower()
-        
-        if normalized in seen_content:
-            ids_to_delete.append(doc_id)
-            print(f"  ❌ Duplicate: [{doc_id}] '{doc[:60]}...'")
-        else:
-            seen_content[normalized] = doc_id
-            print(f"  ✓ Keep:      [{doc_id}] '{doc[:60]}...'")
+    if backfill_ids:
+        print(f"  Backfilling content_sha on {len(backfill_ids)} entries...")
+        for i in range(0, len(backfill_ids), WRITE_CHUNK_SIZE):
+            collection.update(
+                ids=backfill_ids[i:i + WRITE_CHUNK_SIZE],
+                metadatas=backfill_metadatas[i:i + WRITE_CHUNK_SIZE]
+            )
     
     if ids_to_delete:
         print(f"\n  Deleting {len(ids_to_delete)} duplicates...")
-        collection.delete(ids=ids_to_delete)
+        for i in range(0, len(ids_to_delete), WRITE_CHUNK_SIZE):
+            collection.delete(ids=ids_to_delete[i:i + WRITE_CHUNK_SIZE])
         print(f"  ✓ Deleted! {total - len(ids_to_delete)} entries remain.")
     else:
         print("  ✓ No duplicates found!")
@@ -50,6 +71,7 @@ def clean_chroma_db():
 
 def clean_neo4j():
     from neo4j import GraphDatabase
+    from neo4j.exceptions import ClientError
     
     uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
     user = os.getenv("NEO4J_USER", "neo4j")
@@ -64,53 +86,43 @@ def clean_neo4j():
         print(f"  ⚠ Can't connect to Neo4j: {e}")
         return
     
+    # Archive statement tails, fastest first: parallel inner transactions
+    # (Neo4j 5.21+), batched inner transactions (4.4+), then a single transaction
+    archive_variants = (
+        """
+                CALL {
+                    WITH dup
+                    SET dup.status = 'obsolete', dup.archived_at = timestamp()
+                } IN CONCURRENT TRANSACTIONS OF 1000 ROWS""",
+        """
+                CALL {
+                    WITH dup
+                    SET dup.status = 'obsolete', dup.archived_at = timestamp()
+                } IN TRANSACTIONS OF 1000 ROWS""",
+        """
+                SET dup.status = 'obsolete', dup.archived_at = timestamp()""",
+    )
+    
     with driver.session() as session:
-        # Find duplicate entities (same name)
-        result = session.run("""
-            MATCH (e:Entity {status: 'active'})
-            WITH e.name AS name, collect(e) AS entities, count(e) AS cnt
-            WHERE cnt > 1
-            RETURN name, [e IN entities | {id: e.id, name: e.name, type: e.type}] AS dupes, cnt
-        """)
-        
-        for record in result:
-            name = record['name']
-            dupes = record['dupes']
-            print(f"  Found {record['cnt']} duplicates for Entity '{name}':")
-            
-            # Keep the first, archive the rest
-            keep_id = dupes[0]['id']
-            print(f"    ✓ Keep: {keep_id}")
-            
-            for dupe in dupes[1:]:
-                print(f"    ❌ Archive: {dupe['id']}")
-                session.run(
-                    "MATCH (n:Entity {id: $id}) SET n.status = 'obsolete', n.archived_at = timestamp()",
-                    id=dupe['id']
-                )
-        
-        # Also clean duplicate facts (same statement)
-        result = session.run("""
-            MATCH (f:Fact {status: 'active'})
-            WITH f.statement AS stmt, collect(f) AS facts, count(f) AS cnt
-            WHERE cnt > 1
-            RETURN stmt, [f IN facts | {id: f.id, statement: f.statement}] AS dupes, cnt
-        """)
-        
-        for record in result:
-            stmt = record['stmt']
-            dupes = record['dupes']
-            print(f"  Found {record['cnt']} duplicates for Fact '{stmt[:50]}':")
-            
-            keep_id = dupes[0]['id']
-            print(f"    ✓ Keep: {keep_id}")
-            
-            for dupe in dupes[1:]:
-                print(f"    ❌ Archive: {dupe['id']}")
-                session.run(
-                    "MATCH (n:Fact {id: $id}) SET n.status = 'obsolete', n.archived_at = timestamp()",
-                    id=dupe['id']
-                )
+        # Archive duplicate entities (same name) and facts (same statement),
+        # keeping the first of each group, in one server-side statement per pass
+        for label, key in (("Entity", "name"), ("Fact", "statement")):
+            for i, archive in enumerate(archive_variants):
+                try:
+                    archived = session.run(f"""
+                MATCH (n:{label} {{status: 'active'}})
+                WITH n.{key} AS key, collect(n) AS nodes
+                WHERE size(nodes) > 1
+                UNWIND nodes[1..] AS dup{archive}
+                RETURN count(dup) AS archived
+            """).single()["archived"]
+                    break
+                except ClientError as e:
+                    # Only an older server rejecting the CALL form moves on to the
+                    # next variant; auth, constraint and other errors surface
+                    if e.code != "Neo.ClientError.Statement.SyntaxError" or i == len(archive_variants) - 1:
+                        raise
+            print(f"  ✓ Archived {archived} duplicate {label} node(s)")
     
     driver.close()
     print("  ✓ Neo4j cleanup done!")
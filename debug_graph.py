@@ -10,12 +10,18 @@ password = "12345678"
 
 print(f"Connecting to {uri} as {user}...")
 
+def read_graph(tx):
+    # one managed read transaction
+    nodes = list(tx.run("MATCH (n) RETURN labels(n) as labels, n.id as id, properties(n) as props"))
+    rels = list(tx.run("MATCH (a)-[r]->(b) RETURN a.id as source, type(r) as type, b.id as target, properties(r) as props"))
+    return nodes, rels
+
 try:
     driver = GraphDatabase.driver(uri, auth=(user, password))
     with driver.session() as session:
+        nodes, rels = session.execute_read(read_graph)
+        
         print("\n--- Nodes ---")
-        result = session.run("MATCH (n) RETURN labels(n) as labels, n.id as id, properties(n) as props")
-        nodes = list(result)
         if not nodes:
             print("No nodes found.")
         else:
@@ -23,8 +29,6 @@ try:
                 print(f"Labels: {record['labels']}, ID: {record['id']}, Props: {record['props']}")
         
         print("\n--- Relationships ---")
-        result = session.run("MATCH (a)-[r]->(b) RETURN a.id as source, type(r) as type, b.id as target, properties(r) as props")
-        rels = list(result)
         if not rels:
             print("No relationships found.")
         else:
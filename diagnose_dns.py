@@ -1,35 +1,53 @@
 import socket
 import sys
+import asyncio
 
 HOSTNAME = "db.kgxjzpraisfnxeyhyede.supabase.co"
 
+def lookup_ipv4():
+    return socket.gethostbyname(HOSTNAME)
+
+def lookup_ipv6():
+    # AF_INET6, SOCK_STREAM
+    info = socket.getaddrinfo(HOSTNAME, 5432, socket.AF_INET6, socket.SOCK_STREAM)
+    return info[0][4][0]
+
+def lookup_all():
+    return socket.getaddrinfo(HOSTNAME, 5432, socket.AF_UNSPEC, socket.SOCK_STREAM)
+
+async def resolve_all():
+    # The lookups block in the OS resolver, so run them side by side in threads:
+    # the total wait is the slowest lookup rather than the sum of all three
+    return await asyncio.gather(
+        asyncio.to_thread(lookup_ipv4),
+        asyncio.to_thread(lookup_ipv6),
+        asyncio.to_thread(lookup_all),
+        return_exceptions=True
+    )
+
 def diagnosis():
     print(f"Diagnosing DNS for: {HOSTNAME}")
+    ipv4, ipv6, info = asyncio.run(resolve_all())
     
     # 1. IPv4 (A record)
-    try:
-        ipv4 = socket.gethostbyname(HOSTNAME)
+    if isinstance(ipv4, Exception):
+        print(f"FAILURE: IPv4 Resolution failed: {ipv4}")
+    else:
         print(f"SUCCESS: Resolved to IPv4: {ipv4}")
-    except Exception as e:
-        print(f"FAILURE: IPv4 Resolution failed: {e}")
         
     # 2. IPv6 (AAAA record)
-    try:
-        # AF_INET6, SOCK_STREAM
-        info = socket.getaddrinfo(HOSTNAME, 5432, socket.AF_INET6, socket.SOCK_STREAM)
-        ipv6 = info[0][4][0]
+    if isinstance(ipv6, Exception):
+        print(f"FAILURE: IPv6 Resolution failed: {ipv6}")
+    else:
         print(f"SUCCESS: Resolved to IPv6: {ipv6}")
-    except Exception as e:
-        print(f"FAILURE: IPv6 Resolution failed: {e}")
         
     # 3. All records
-    try:
-        info = socket.getaddrinfo(HOSTNAME, 5432, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    if isinstance(info, Exception):
+        print(f"FAILURE: General Resolution failed: {info}")
+    else:
         for i in info:
             family = "IPv6" if i[0] == socket.AF_INET6 else "IPv4"
             print(f"Found {family}: {i[4][0]}")
-    except Exception as e:
-        print(f"FAILURE: General Resolution failed: {e}")
 
 if __name__ == "__main__":
     diagnosis()
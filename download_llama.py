@@ -1,5 +1,7 @@
 import os
-import requests
+import json
+import asyncio
+import httpx
 import sys
 from urllib.parse import urlparse, parse_qs
 
@@ -15,28 +17,101 @@ QUERY_STRING = "Policy=eyJTdGF0ZW1lbnQiOlt7InVuaXF1ZV9oYXNoIjoibzMzaXQyYmtsbWxwY
 TARGET_DIR = "models/llama-3.2-3b"
 os.makedirs(TARGET_DIR, exist_ok=True)
 
-def download_file(path):
+# Cap on simultaneous requests to the CDN
+MAX_CONCURRENCY = 4
+CHUNK_SIZE = 1 << 20          # 1 MiB reads from the response body
+# Files at least this large are fetched as parallel Range requests of
+# RANGE_SIZE bytes; finished ranges are recorded so a rerun resumes
+RANGE_MIN_SIZE = 64 << 20
+RANGE_SIZE = 64 << 20
+RANGE_RETRIES = 3
+
+async def probe(client, path):
+    """HEAD the path so only files that exist get downloaded.
+    Returns the file size if it can be fetched in ranges, 0 if it can only be
+    streamed whole, or None if it isn't available."""
+    url = f"{BASE_URL}/{path}?{QUERY_STRING}"
+    try:
+        r = await client.head(url)
+    except Exception as e:
+        print(f"Error probing {path}: {e}")
+        return None
+    if r.status_code != 200:
+        print(f"Failed to download {path}: {r.status_code} {r.reason_phrase}")
+        return None
+    if r.headers.get("accept-ranges") == "bytes":
+        return int(r.headers.get("content-length", 0))
+    return 0
+
+async def download_file(client, path, size):
     # Construct URL: BASE_URL + / + path + ? + QUERY_STRING
     url = f"{BASE_URL}/{path}?{QUERY_STRING}"
+    local_path = os.path.join(TARGET_DIR, path)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
     print(f"Downloading {path}...")
     try:
-        with requests.get(url, stream=True) as r:
-            if r.status_code != 200:
-                print(f"Failed to download {path}: {r.status_code} {r.reason}")
-                return False
-            
-            # Save to disk
-            local_path = os.path.join(TARGET_DIR, path)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        if size >= RANGE_MIN_SIZE:
+            await download_ranges(client, url, local_path, size)
+        else:
+            async with client.stream("GET", url) as r:
+                if r.status_code != 200:
+                    print(f"Failed to download {path}: {r.status_code} {r.reason_phrase}")
+                    return False
+                
+                # Save to disk
+                with open(local_path, 'wb') as f:
+                    async for chunk in r.aiter_bytes(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
         print(f"Downloaded {path}")
         return True
     except Exception as e:
         print(f"Error downloading {path}: {e}")
         return False
 
+async def download_ranges(client, url, local_path, size):
+    """Fetches a large file as concurrent Range requests into a preallocated
+    .part file. A sidecar lists finished ranges so an interrupted run resumes."""
+    part_path = local_path + ".part"
+    state_path = part_path + ".json"
+    done = set()
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path) as f:
+            done = set(json.load(f))
+    else:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    
+    pending = [start for start in range(0, size, RANGE_SIZE) if start not in done]
+    if done:
+        print(f"Resuming {os.path.basename(local_path)}: {len(done)} range(s) already downloaded")
+    limiter = asyncio.Semaphore(MAX_CONCURRENCY)
+    
+    async def fetch(start):
+        end = min(start + RANGE_SIZE, size) - 1
+        async with limiter:
+            for attempt in range(RANGE_RETRIES):
+                try:
+                    async with client.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as r:
+                        if r.status_code != 206:
+                            raise RuntimeError(f"{r.status_code} {r.reason_phrase}")
+                        with open(part_path, "r+b") as f:
+                            f.seek(start)
+                            async for chunk in r.aiter_bytes(chunk_size=CHUNK_SIZE):
+                                f.write(chunk)
+                    break
+                except Exception as e:
+                    if attempt == RANGE_RETRIES - 1:
+                        raise
+                    print(f"Retrying bytes {start}-{end}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+        done.add(start)
+        with open(state_path, "w") as f:
+            json.dump(sorted(done), f)
+    
+    await asyncio.gather(*(fetch(start) for start in pending))
+    os.replace(part_path, local_path)
+    os.remove(state_path)
+
 # Try common paths for Llama 3.2
 # The signed link is for "lightweight" models (1B and 3B).
 # Usually structure is:
@@ -62,10 +137,17 @@ files_to_try = [
     "3B/tokenizer.model"
 ]
 
-success = False
-for f in files_to_try:
-    if download_file(f):
-        success = True
+async def main():
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY)
+    # No pool timeout: range requests queue for a connection while others stream
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30, pool=None), limits=limits) as client:
+        # Probe every candidate at once, then fetch only the ones that exist
+        sizes = await asyncio.gather(*(probe(client, f) for f in files_to_try))
+        available = [(f, size) for f, size in zip(files_to_try, sizes) if size is not None]
+        results = await asyncio.gather(*(download_file(client, f, size) for f, size in available))
+    return any(results)
+
+success = asyncio.run(main())
 
 if not success:
     print("Failed to download any files. The URL might be expired or the path structure is different.")
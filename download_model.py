@@ -1,4 +1,5 @@
 import os
+import shutil
 import requests
 from tqdm import tqdm
 
@@ -14,16 +15,16 @@ def download_file(url, filename):
     headers = {'User-Agent': 'Mozilla/5.0'}
     response = requests.get(url, stream=True, headers=headers)
     total_size_in_bytes = int(response.headers.get('content-length', 0))
-    block_size = 1024 # 1 Kibibyte
-    progress_bar = tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True)
+    block_size = 1 << 20 # 1 Mebibyte
     
-    with open(filename, 'wb') as file:
-        for data in response.iter_content(block_size):
-            progress_bar.update(len(data))
-            file.write(data)
-    progress_bar.close()
+    # copyfileobj reads the raw stream directly (no iter_content generator);
+    # tqdm sees one update per MiB and redraws at most twice a second
+    response.raw.decode_content = True
+    with tqdm.wrapattr(open(filename, 'wb'), 'write', total=total_size_in_bytes,
+                       unit='iB', unit_scale=True, mininterval=0.5) as file:
+        shutil.copyfileobj(response.raw, file, length=block_size)
     
-    if total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
+    if total_size_in_bytes != 0 and os.path.getsize(filename) != total_size_in_bytes:
         print("ERROR, something went wrong")
         return False
     print("Download complete!")
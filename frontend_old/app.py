@@ -1,10 +1,24 @@
 import streamlit as st
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import uuid
 
 # Configuration
 API_URL = "http://localhost:8000/chat"
 
+@st.cache_resource
+def get_session():
+    # One pooled session for all reruns, so each turn reuses the keep-alive
+    # connection to the backend. Retry covers connection failures; POSTs are
+    # not re-sent after the backend has received them.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 st.set_page_config(page_title="Hybrid Memory RAG", page_icon="🧠", layout="wide")
 
 st.title("🧠 Hybrid Memory RAG")
@@ -109,7 +123,9 @@ def render_log_details(logs):
             st.markdown("**Graph Source:** `Neo4j`")
             graph = s2.get("graph", [])
             if graph:
-                st.write(graph)
+                # Pre-serialized JSON in a code block renders far faster than
+                # st.write's interactive JSON widget on large graph payloads
+                st.code(orjson.dumps(graph, option=orjson.OPT_INDENT_2, default=str).decode(), language="json")
             else:
                 st.info("No relevant graph nodes found.")
         else:
@@ -172,7 +188,7 @@ def render_grounding(metadata):
             st.markdown(f"{i}. [{title}]({url})")
 
 # Display Chat History
-for message in st.session_state.messages:
+for i, message in enumerate(st.session_state.messages):
     if message["role"] == "user":
         with st.chat_message("user"):
             st.markdown(message["content"])
@@ -184,8 +200,11 @@ for message in st.session_state.messages:
             if message.get("grounding_metadata"):
                 render_grounding(message["grounding_metadata"])
             
+            # Streamlit reruns this loop on every interaction and an expander
+            # builds its contents even when collapsed, so past messages only
+            # build the tabs while their toggle is on
             if message.get("details"):
-                with st.expander("Memory Context & Reasoning"):
+                if st.toggle("Memory Context & Reasoning", key=f"details_{i}"):
                     render_log_details(message["details"])
 
 # Chat Input
@@ -199,7 +218,7 @@ if prompt := st.chat_input("What would you like to say?"):
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
             try:
-                response = requests.post(
+                response = get_session().post(
                     f"{API_URL}", 
                     json={"message": prompt, "user_id": st.session_state.user_id}
                 )
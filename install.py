@@ -1,81 +1,163 @@
 import os
+import re
 import sys
+import json
+import argparse
 import subprocess
 import shutil
+import hashlib
+import venv
 import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The installer may run before requirements (python-dotenv) are installed
+try:
+    from dotenv import dotenv_values
+except ImportError:
+    dotenv_values = None
+
+# Python and frontend installs run concurrently; keep status lines whole
+_print_lock = threading.Lock()
 
 def print_step(step):
-    print(f"\n\033[1;36m[STEP] {step}\033[0m")
+    with _print_lock:
+        print(f"\n\033[1;36m[STEP] {step}\033[0m")
 
 def print_success(msg):
-    print(f"\033[1;32m[SUCCESS] {msg}\033[0m")
+    with _print_lock:
+        print(f"\033[1;32m[SUCCESS] {msg}\033[0m")
 
 def print_warning(msg):
-    print(f"\033[1;33m[WARNING] {msg}\033[0m")
+    with _print_lock:
+        print(f"\033[1;33m[WARNING] {msg}\033[0m")
 
 def print_error(msg):
-    print(f"\033[1;31m[ERROR] {msg}\033[0m")
+    with _print_lock:
+        print(f"\033[1;31m[ERROR] {msg}\033[0m")
 
 def run_command(command, cwd=None):
+    # Always an argument list, executed directly (no intermediate shell). The
+    # program is resolved on PATH first so Windows .cmd shims (npm, pnpm) run too.
+    if not isinstance(command, list):
+        raise TypeError("run_command expects an argument list")
+    executable = shutil.which(command[0]) or command[0]
     try:
-        # Use shell=True if the command is a string, otherwise shell=False for list
-        is_shell = isinstance(command, str)
-        subprocess.check_call(command, cwd=cwd, shell=is_shell)
+        subprocess.check_call([executable, *command[1:]], cwd=cwd)
     except subprocess.CalledProcessError as e:
         print_error(f"Command failed: {command}")
         sys.exit(1)
     except FileNotFoundError:
-        cmd_name = command[0] if isinstance(command, list) else command.split()[0]
-        print_error(f"Command not found: {cmd_name}")
+        print_error(f"Command not found: {command[0]}")
         sys.exit(1)
 
-def check_requirements():
-    print_step("Checking prerequisites...")
-    
-    # Check Python
+# Each prerequisite probe returns (ok, [(printer, message), ...]) so the probes
+# can run concurrently and still report in a fixed order
+
+def check_python():
     python_version = sys.version.split()[0]
-    print(f"Python version: {python_version}")
+    report = [(print, f"Python version: {python_version}")]
     if sys.version_info < (3, 9):
-        print_error("Python 3.9+ is required.")
-        sys.exit(1)
+        return False, report + [(print_error, "Python 3.9+ is required.")]
+    return True, report
 
-    # Check Node.js
+def check_node():
+    # Look node up on PATH first; only spawn it once it's known to exist
+    node_path = shutil.which("node")
     try:
-        node_version_raw = subprocess.check_output(["node", "-v"], text=True).strip()
-        print(f"Node.js version: {node_version_raw}")
+        if not node_path:
+            raise FileNotFoundError("node")
+        node_version_raw = subprocess.check_output([node_path, "-v"], text=True).strip()
+        report = [(print, f"Node.js version: {node_version_raw}")]
         
         # Simple version check (v18+)
         major_version = int(node_version_raw.lstrip('v').split('.')[0])
         if major_version < 18:
-            print_warning("Node.js v18+ is recommended. Your version might cause issues.")
+            report.append((print_warning, "Node.js v18+ is recommended. Your version might cause issues."))
+        return True, report
     except (FileNotFoundError, subprocess.CalledProcessError, ValueError):
-        print_error("Node.js is not installed. Please install Node.js (v18+ recommended).")
+        return False, [(print_error, "Node.js is not installed. Please install Node.js (v18+ recommended).")]
+
+PREREQUISITE_CHECKS = [check_python, check_node]
+
+def check_requirements():
+    print_step("Checking prerequisites...")
+    
+    with ThreadPoolExecutor(max_workers=len(PREREQUISITE_CHECKS)) as ex:
+        results = list(ex.map(lambda check: check(), PREREQUISITE_CHECKS))
+    
+    all_ok = True
+    for ok, report in results:
+        for printer, message in report:
+            printer(message)
+        all_ok = all_ok and ok
+    if not all_ok:
         sys.exit(1)
 
 def setup_python_env():
     print_step("Setting up Python virtual environment...")
     
     venv_dir = ".venv"
-    if not os.path.exists(venv_dir):
-        print("Creating .venv...")
-        run_command([sys.executable, "-m", "venv", venv_dir])
+    # Determine the venv's interpreter; pip runs as `python -m pip` so it can
+    # upgrade itself (pip.exe can't replace itself while running on Windows)
+    if platform.system() == "Windows":
+        venv_python = os.path.join(venv_dir, "Scripts", "python.exe")
     else:
-        print(".venv already exists.")
+        venv_python = os.path.join(venv_dir, "bin", "python")
 
-    # Determine pip path
-    if platform.system() == "Windows":
-        pip_cmd = os.path.join(venv_dir, "Scripts", "pip")
+    # A venv left half-created by an interrupted run has no pyvenv.cfg or
+    # interpreter yet; rebuild it rather than failing later in pip
+    venv_ok = os.path.isfile(os.path.join(venv_dir, "pyvenv.cfg")) and os.path.isfile(venv_python)
+    if not venv_ok:
+        print("Creating .venv...")
+        # Built in-process instead of spawning `python -m venv`
+        venv.EnvBuilder(
+            with_pip=True, clear=True,
+            symlinks=(platform.system() != "Windows")
+        ).create(venv_dir)
     else:
-        pip_cmd = os.path.join(venv_dir, "bin", "pip")
+        print(".venv already exists.")
 
     print_step("Installing Python dependencies...")
     if os.path.exists("requirements.txt"):
-        run_command([pip_cmd, "install", "-r", "requirements.txt"])
+        # Skip pip entirely when requirements.txt hasn't changed since the last install
+        with open("requirements.txt", "rb") as f:
+            req_hash = hashlib.sha256(f.read()).hexdigest()
+        stamp_file = os.path.join(venv_dir, ".req.sha256")
+        if os.path.exists(stamp_file):
+            with open(stamp_file) as f:
+                if f.read().strip() == req_hash:
+                    print_success("Python dependencies already up to date.")
+                    return
+
+        uv_cmd = shutil.which("uv")
+        if uv_cmd:
+            # uv resolves and downloads in parallel and keeps its own global wheel cache
+            run_command([uv_cmd, "pip", "install", "--python", venv_python, "-r", "requirements.txt"])
+        else:
+            print_warning("uv not found; using pip (`pipx install uv` makes installs much faster).")
+            # One pip process: upgrade pip/wheel and install the requirements together.
+            # Prefer prebuilt wheels, and keep pip's cache (including wheels it had to
+            # build) in the repo so reinstalls don't recompile native packages.
+            run_command([
+                venv_python, "-m", "pip", "install", "--prefer-binary",
+                "--cache-dir", os.path.abspath(".pip-cache"),
+                "--upgrade", "pip", "wheel", "-r", "requirements.txt"
+            ])
+        with open(stamp_file, "w") as f:
+            f.write(req_hash)
         print_success("Python dependencies installed.")
     else:
         print_warning("requirements.txt not found. Skipping dependency installation.")
 
-def setup_env_file():
+# KEY=value lines of a .env file (comments skipped, optional `export` and
+# surrounding quotes stripped); used when python-dotenv isn't installed yet
+ENV_LINE_RE = re.compile(
+    r"""^[ \t]*(?:export[ \t]+)?(?P<key>[A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*(?P<q>["']?)(?P<val>.*?)(?P=q)[ \t]*$""",
+    re.MULTILINE
+)
+
+def setup_env_file(reconfigure=False, non_interactive=False):
     print_step("Configuring environment variables...")
     
     env_vars = [
@@ -94,24 +176,45 @@ def setup_env_file():
     current_env = {}
     if os.path.exists(".env"):
         print("Loading existing .env...")
-        with open(".env", "r") as f:
-            for line in f:
-                if "=" in line:
-                    key, val = line.strip().split("=", 1)
-                    current_env[key] = val
-
-    new_env = {}
-    for var in env_vars:
-        default_val = current_env.get(var, "")
-        user_input = input(f"{var} [{default_val}]: ").strip()
-        new_env[var] = user_input if user_input else default_val
+        if dotenv_values:
+            # Handles comments, quoting and `export` prefixes like the app's load_dotenv
+            current_env = {k: v for k, v in dotenv_values(".env").items() if v is not None}
+        else:
+            with open(".env", "r") as f:
+                current_env = {m["key"]: m["val"] for m in ENV_LINE_RE.finditer(f.read())}
+
+    # Start from the existing file so optional settings aren't dropped
+    new_env = dict(current_env)
+    if non_interactive:
+        # One JSON object on stdin, e.g. {"GOOGLE_API_KEY": "..."}; no prompts
+        raw = sys.stdin.read().strip()
+        if raw:
+            new_env.update({k: str(v) for k, v in json.loads(raw).items()})
+    else:
+        for var in env_vars:
+            default_val = current_env.get(var, "")
+            # Only ask for what's missing unless a full reconfigure was requested
+            if default_val and not reconfigure:
+                continue
+            user_input = input(f"{var} [{default_val}]: ").strip()
+            new_env[var] = user_input if user_input else default_val
 
     with open(".env", "w") as f:
-        for key, val in new_env.items():
-            f.write(f"{key}={val}\n")
+        f.write("".join(f"{key}={val}\n" for key, val in new_env.items()))
     
     print_success(".env file updated.")
 
+def detect_package_manager(frontend_dir):
+    """SEKHMET_PKG_MGR if set, else the manager whose lockfile is present and
+    installed (so its store/cache is reused), else npm."""
+    override = os.environ.get("SEKHMET_PKG_MGR")
+    if override:
+        return override
+    for lockfile, manager in (("pnpm-lock.yaml", "pnpm"), ("yarn.lock", "yarn")):
+        if os.path.exists(os.path.join(frontend_dir, lockfile)) and shutil.which(manager):
+            return manager
+    return "npm"
+
 def setup_frontend():
     print_step("Setting up Frontend...")
     
@@ -120,29 +223,39 @@ def setup_frontend():
         print_error(f"Frontend directory '{frontend_dir}' not found.")
         return
 
-    # Detect package manager
-    pkg_manager = "npm"
-    if shutil.which("pnpm"):
-        pkg_manager = "pnpm"
-    elif shutil.which("yarn"):
-        pkg_manager = "yarn"
-    
+    pkg_manager = detect_package_manager(frontend_dir)
     print(f"Using package manager: {pkg_manager}")
     
-    # Install dependencies
+    # Install dependencies (npm ci does a clean, lockfile-exact install, which
+    # is faster than npm install when a package-lock.json exists)
     print("Installing frontend dependencies...")
-    run_command([pkg_manager, "install"], cwd=frontend_dir)
+    if pkg_manager == "npm" and os.path.exists(os.path.join(frontend_dir, "package-lock.json")):
+        run_command(["npm", "ci"], cwd=frontend_dir)
+    else:
+        run_command([pkg_manager, "install"], cwd=frontend_dir)
     print_success("Frontend dependencies installed.")
 
 def main():
+    parser = argparse.ArgumentParser(description="Sekhmet (NeuroHack) installer")
+    parser.add_argument("--reconfigure", action="store_true",
+                        help="prompt for every .env value, not just missing ones")
+    parser.add_argument("--non-interactive", action="store_true",
+                        help="read .env values as a JSON object from stdin instead of prompting")
+    args = parser.parse_args()
+    
     print("\n===========================================")
     print("   Sekhmet (NeuroHack) Installer Setup   ")
     print("===========================================\n")
     
     check_requirements()
-    setup_python_env()
-    setup_env_file()
-    setup_frontend()
+    # Prompts for input, so it runs before the installs start printing
+    setup_env_file(reconfigure=args.reconfigure, non_interactive=args.non_interactive)
+    
+    # .venv and frontend/node_modules are independent and mostly network-bound
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [ex.submit(setup_python_env), ex.submit(setup_frontend)]
+        for future in as_completed(futures):
+            future.result()
     
     print("\n===========================================")
     print("   Installation Complete!   ")
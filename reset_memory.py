@@ -5,65 +5,110 @@ WARNING: This script will WIPE ALL DATA from ChromaDB and Neo4j.
 Use with caution!
 """
 
-import chromadb
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
 from dotenv import load_dotenv
 import os
+import argparse
+import functools
+import atexit
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
-def clear_chroma_db():
-    print("🧹 Cleaning ChromaDB...")
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
+
+@functools.lru_cache(maxsize=1)
+def chroma_client():
+    """Module-wide ChromaDB client for the local store."""
+    # Imported here so the default (directory) wipe never loads chromadb
+    import chromadb
+    return chromadb.PersistentClient(path="./chroma_db")
+
+_DRIVER = None
+
+def get_driver():
+    """Module-wide Neo4j driver (one connection pool per run), closed at exit."""
+    global _DRIVER
+    if _DRIVER is None:
+        _DRIVER = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), max_connection_pool_size=4)
+        atexit.register(_DRIVER.close)
+    return _DRIVER
+
+def clear_chroma_db(out=print, soft=False):
+    out("🧹 Cleaning ChromaDB...")
     try:
-        # Method 1: Use client to delete collection
-        client = chromadb.PersistentClient(path="./chroma_db")
+        if not soft:
+            # Removing the store directory wipes every collection without
+            # starting Chroma (sqlite schema, segment manager, embedder)
+            if os.path.exists("./chroma_db"):
+                shutil.rmtree("./chroma_db")
+                out("  ✓ Removed chroma_db directory.")
+            else:
+                out("  ⚠ chroma_db directory not found.")
+            return
+        
+        # Soft mode: delete through the client (works while the store is held open)
+        client = chroma_client()
         try:
             client.delete_collection("conversation_memory")
-            print("  ✓ Deleted 'conversation_memory' collection.")
+            out("  ✓ Deleted 'conversation_memory' collection.")
         except ValueError:
-            print("  ⚠ Collection 'conversation_memory' not found.")
-        
-        # Method 2: Nuke the directory (if needed, but client delete is safer)
-        # if os.path.exists("./chroma_db"):
-        #     shutil.rmtree("./chroma_db")
-        #     print("  ✓ Removed chroma_db directory.")
+            out("  ⚠ Collection 'conversation_memory' not found.")
             
     except Exception as e:
-        print(f"  ❌ Error cleaning ChromaDB: {e}")
+        out(f"  ❌ Error cleaning ChromaDB: {e}")
 
-def clear_neo4j():
-    print("\n🧹 Cleaning Neo4j Graph...")
+def clear_neo4j(out=print):
+    out("\n🧹 Cleaning Neo4j Graph...")
     
-    uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-    user = os.getenv("NEO4J_USER", "neo4j")
-    password = os.getenv("NEO4J_PASSWORD", "password")
-    
-    if not uri or not password:
-        print("  ❌ Missing Neo4j credentials in .env")
+    if not NEO4J_URI or not NEO4J_PASSWORD:
+        out("  ❌ Missing Neo4j credentials in .env")
         return
 
     try:
-        driver = GraphDatabase.driver(uri, auth=(user, password))
+        driver = get_driver()
         driver.verify_connectivity()
         
         with driver.session() as session:
-            # Delete all nodes and relationships
-            result = session.run("MATCH (n) DETACH DELETE n")
-            summary = result.consume()
-            print(f"  ✓ Deleted {summary.counters.nodes_deleted} nodes and {summary.counters.relationships_deleted} relationships.")
+            # Delete all nodes and relationships in bounded batches so large
+            # graphs don't build one huge transaction (needs Neo4j 4.4+)
+            try:
+                result = session.run("MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS")
+                summary = result.consume()
+            except ClientError:
+                result = session.run("MATCH (n) DETACH DELETE n")
+                summary = result.consume()
+            out(f"  ✓ Deleted {summary.counters.nodes_deleted} nodes and {summary.counters.relationships_deleted} relationships.")
             
-        driver.close()
     except Exception as e:
-        print(f"  ❌ Error cleaning Neo4j: {e}")
+        out(f"  ❌ Error cleaning Neo4j: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wipe all vector and graph memory")
+    parser.add_argument("--soft", action="store_true",
+                        help="delete the Chroma collection through the client instead of removing chroma_db/ "
+                             "(use when the store is open in another process)")
+    args = parser.parse_args()
+    
     print("⚠ WARNING: This will DELETE ALL MEMORY (Vector + Graph).")
     confirm = input("Are you sure? (Type 'yes' to proceed): ")
     
     if confirm.lower() == 'yes':
-        clear_chroma_db()
-        clear_neo4j()
+        # The two stores are independent: wipe them concurrently, buffering each
+        # one's status lines so they print as contiguous blocks afterwards
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            futures = []
+            for clear in (clear_chroma_db, clear_neo4j):
+                lines = []
+                kwargs = {"soft": args.soft} if clear is clear_chroma_db else {}
+                futures.append((lines, ex.submit(clear, lines.append, **kwargs)))
+            for lines, future in futures:
+                future.result()
+                print("\n".join(lines))
         print("\n✨ Memory Reset Complete.")
     else:
         print("\n❌ Operation cancelled.")
@@ -1,46 +1,71 @@
 import os
+import argparse
+import functools
+import atexit
 import chromadb
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def test_connections():
+NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
+
+@functools.lru_cache(maxsize=1)
+def chroma_client():
+    """Module-wide ChromaDB client for the local store."""
+    return chromadb.PersistentClient(path="./chroma_db")
+
+_DRIVER = None
+
+def get_driver():
+    """Module-wide Neo4j driver (one connection pool per run), closed at exit."""
+    global _DRIVER
+    if _DRIVER is None:
+        _DRIVER = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), max_connection_pool_size=4)
+        atexit.register(_DRIVER.close)
+    return _DRIVER
+
+def test_connections(deep=False):
+    """Connectivity smoke test; deep=True also does a read/write round-trip
+    (which embeds a document, so it is much slower)."""
     print("Testing Connections...")
     
     # 1. Test ChromaDB
     try:
         print("\n[ChromaDB] Connecting...")
-        chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        chroma_client.heartbeat()
+        client = chroma_client()
+        client.heartbeat()
         print("[ChromaDB] Logic Check: Heartbeat successful.")
-        collection = chroma_client.get_or_create_collection(name="test_collection")
-        collection.add(documents=["test"], ids=["test_id"])
-        results = collection.query(query_texts=["test"], n_results=1)
-        print(f"[ChromaDB] Read/Write Check: {results['ids']}")
-        chroma_client.delete_collection("test_collection")
+        if deep:
+            collection = client.get_or_create_collection(name="test_collection")
+            collection.add(documents=["test"], ids=["test_id"])
+            results = collection.query(query_texts=["test"], n_results=1)
+            print(f"[ChromaDB] Read/Write Check: {results['ids']}")
+            client.delete_collection("test_collection")
         print("[ChromaDB] Success.")
     except Exception as e:
         print(f"[ChromaDB] Failed: {e}")
 
     # 2. Test Neo4j
-    neo4j_uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-    neo4j_user = os.getenv("NEO4J_USER", "neo4j")
-    neo4j_password = os.getenv("NEO4J_PASSWORD", "password")
-
     try:
         print("\n[Neo4j] Connecting...")
-        driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password))
+        driver = get_driver()
         driver.verify_connectivity()
         print("[Neo4j] Connectivity verified.")
-        with driver.session() as session:
-            result = session.run("RETURN 1 as val")
-            val = result.single()["val"]
-            print(f"[Neo4j] Query Check: returned {val}")
-        driver.close()
+        if deep:
+            with driver.session() as session:
+                result = session.run("RETURN 1 as val")
+                val = result.single()["val"]
+                print(f"[Neo4j] Query Check: returned {val}")
         print("[Neo4j] Success.")
     except Exception as e:
         print(f"[Neo4j] Failed: {e}")
 
 if __name__ == "__main__":
-    test_connections()
+    parser = argparse.ArgumentParser(description="Check ChromaDB and Neo4j connectivity")
+    parser.add_argument("--deep", action="store_true",
+                        help="also run a read/write check against each store")
+    args = parser.parse_args()
+    test_connections(deep=args.deep)